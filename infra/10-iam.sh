@@ -88,6 +88,12 @@ cat > "$APP_PERMS" <<JSON
         "arn:aws:s3:::${BUCKET}/indexes/*"
       ]
     },
+    {
+      "Sid": "S3AnswerCache",
+      "Effect": "Allow",
+      "Action": ["s3:GetObject","s3:PutObject"],
+      "Resource": "arn:aws:s3:::${BUCKET}/cache/answers/*"
+    },
     {
       "Sid": "KmsDecrypt",
       "Effect": "Allow",
@@ -139,6 +145,12 @@ cat > "$INDEXER_PERMS" <<JSON
         "arn:aws:s3:::${BUCKET}/indexes/*"
       ]
     },
+    {
+      "Sid": "S3IncrementalIndexes",
+      "Effect": "Allow",
+      "Action": ["s3:GetObject","s3:DeleteObject"],
+      "Resource": "arn:aws:s3:::${BUCKET}/indexes/*"
+    },
     {
       "Sid": "KmsUse",
       "Effect": "Allow",
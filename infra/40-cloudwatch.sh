@@ -16,6 +16,7 @@ FN_NAME="${FN_NAME:-edubot-api-fn}"
 DASHBOARD_NAME="${DASHBOARD_NAME:-EduBot-MVP}"
 LOG_GROUP="/aws/lambda/${FN_NAME}"
 RETENTION_DAYS="${RETENTION_DAYS:-14}"
+METRICS_NAMESPACE="${METRICS_NAMESPACE:-EduBot}"
 set -u
 
 echo "Project: $PROJECT"
@@ -54,6 +55,26 @@ cat > /tmp/dashboard.json <<JSON
         "stacked": false,
         "period": 300
       }
+    },
+    {
+      "type": "metric", "x": 12, "y": 0, "width": 12, "height": 12,
+      "properties": {
+        "title": "/ask Stage Latency (p95, from EMF logs)",
+        "region": "$REGION",
+        "metrics": [
+          [ "$METRICS_NAMESPACE", "s3_list_ms", "Route", "/ask", { "stat": "p95" } ],
+          [ ".", "s3_fetch_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "revalidate_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "score_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "prompt_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "gemini_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "bedrock_ms", ".", ".", { "stat": "p95" } ],
+          [ ".", "total_ms", ".", ".", { "stat": "p95" } ]
+        ],
+        "view": "timeSeries",
+        "stacked": false,
+        "period": 300
+      }
     }
   ]
 }
@@ -70,6 +70,7 @@ ensure_route () {
 ensure_route "GET /health"
 ensure_route "GET /indexes"
 ensure_route "POST /ask"
+ensure_route "POST /ask/batch"
 
 # Create or update stage
 STAGE_EXISTS=$(aws apigatewayv2 get-stage --api-id "${API_ID}" --stage-name "${STAGE}" \
@@ -1,11 +1,34 @@
 import json
 import os
-import boto3
 import time
 import logging
 from urllib.parse import unquote_plus
 import base64
-import requests
+import contextvars
+import hashlib
+import heapq
+import itertools
+import math
+import mmap
+import random
+import re
+import socket
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# import_ms covers the third-party imports below; boto3 and requests are
+# imported on first use (see _Lazy), numpy eagerly as every ranked /ask needs it
+_IMPORT_STARTED = time.perf_counter()
+from botocore.exceptions import ClientError  # noqa: E402
+
+try:
+    import numpy as np
+except ImportError:  # optional: without it /ask ranks with BM25 alone
+    np = None
+_COLD_START = {"import_ms": round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)}
 
 log = logging.getLogger()
 log.setLevel(logging.INFO)
@@ -20,11 +43,346 @@ TOP_K = int(os.environ.get("TOP_K", "20"))
 MODEL_ID = os.environ.get("BEDROCK_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
+# auto: mmap'd index.bin, then packed shard.json, then per-section JSONs
+INDEX_MODE = os.environ.get("INDEX_MODE", "auto")
+INDEX_DIR = os.environ.get("INDEX_DIR", "/tmp/edubot-index")
+SHARD_NAME = "shard.json"
+BINARY_NAME = "index.bin"
+# Must match tools/indexer.py's index.bin layout
+BINARY_MAGIC = b"EDUIDX01"
+BINARY_HEADER = struct.Struct("<8sIII")
+BINARY_SPAN = struct.Struct("<QI")
+BM25_NAME = "bm25.json"
+# Concurrent section GETs for the per-section layout, per book
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "8"))
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+LSA_NAME = "lsa.bin"
+# Must match tools/indexer.py's lsa.bin layout
+LSA_MAGIC = b"EDULSA01"
+LSA_HEADER = struct.Struct("<8sIIIII")
+# bm25, lsa, or hybrid (BM25 blended with LSA cosine); lsa and hybrid need numpy and the book's lsa.bin
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+LSA_WEIGHT = float(os.environ.get("LSA_WEIGHT", "0.4"))
+# Upper bound on books one /ask may fan out to (book_ids or subject)
+MAX_BOOKS = int(os.environ.get("MAX_BOOKS", "8"))
+# POST /ask/batch: most questions per call, and LLM calls in flight at once
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "50"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+# CloudWatch Embedded Metric Format namespace for per-stage timings and counters
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "EduBot")
+# /health: dependency probe results are reused for this long (default mode), and
+# mode=ready re-probes at most this often
+HEALTH_PROBE_TTL = float(os.environ.get("HEALTH_PROBE_TTL", "30"))
+HEALTH_READY_MIN_SECONDS = float(os.environ.get("HEALTH_READY_MIN_SECONDS", "5"))
+# Outbound connections. S3 fans out to FETCH_WORKERS GETs for each of up to MAX_BOOKS
+# books; Bedrock sees the hedging pool plus BATCH_CONCURRENCY. Pools are per client.
+S3_POOL_CONNECTIONS = int(os.environ.get("S3_POOL_CONNECTIONS", str(max(10, FETCH_WORKERS * MAX_BOOKS))))
+BEDROCK_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_POOL_CONNECTIONS", "16"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "3"))
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+GEMINI_CONNECT_TIMEOUT = float(os.environ.get("GEMINI_CONNECT_TIMEOUT", "3.05"))
+GEMINI_READ_TIMEOUT = float(os.environ.get("GEMINI_READ_TIMEOUT", "30"))
+GEMINI_RETRIES = int(os.environ.get("GEMINI_RETRIES", "2"))
+# Bedrock throughput governor: this container's share of the tokens-per-minute quota
+# (0: no client-side budget), and how long one request may wait or retry for it
+BEDROCK_TPM = int(os.environ.get("BEDROCK_TPM", "0"))
+BEDROCK_MAX_TOKENS = 400
+BEDROCK_MAX_WAIT_SECONDS = float(os.environ.get("BEDROCK_MAX_WAIT_SECONDS", "20"))
+BEDROCK_BACKOFF_BASE = float(os.environ.get("BEDROCK_BACKOFF_BASE", "0.25"))
+BEDROCK_BACKOFF_CAP = float(os.environ.get("BEDROCK_BACKOFF_CAP", "4"))
+# Kept back from the Lambda deadline to build and return the response
+DEADLINE_MARGIN_SECONDS = float(os.environ.get("DEADLINE_MARGIN_SECONDS", "1"))
+# Load the INDEX_PREFIX book (and the answering backend's client) during Lambda init
+PREWARM_INDEX = os.environ.get("PREWARM_INDEX", "false") == "true"
+BOOK_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+
+# Warm per-book index cache, revalidated against toc.json's ETag
+INDEX_CACHE_BYTES = int(os.environ.get("INDEX_CACHE_MB", "128")) * 1024 * 1024
+INDEX_REVALIDATE_SECONDS = float(os.environ.get("INDEX_REVALIDATE_SECONDS", "60"))
+# GET /indexes catalog: rebuilt from the toc.json files at most this often; page sizes
+CATALOG_TTL_SECONDS = float(os.environ.get("CATALOG_TTL_SECONDS", str(INDEX_REVALIDATE_SECONDS)))
+CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", "50"))
+CATALOG_MAX_PAGE_SIZE = 200
+
+# Answer cache: in-process LRU with TTL, plus an optional shared tier in S3
+# (ANSWER_CACHE_PREFIX) or a local directory (ANSWER_CACHE_DIR, for tests/dev)
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_PREFIX = os.environ.get("ANSWER_CACHE_PREFIX")
+ANSWER_CACHE_DIR = os.environ.get("ANSWER_CACHE_DIR")
+
+# Prompt context budgets, in estimated tokens (~4 characters per token)
+GEMINI_CONTEXT_TOKENS = int(os.environ.get("GEMINI_CONTEXT_TOKENS", "7500"))
+BEDROCK_CONTEXT_TOKENS = int(os.environ.get("BEDROCK_CONTEXT_TOKENS", "3000"))
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Snippets: send the best SNIPPET_WINDOWS windows of up to SNIPPET_SENTENCES sentences
+# around query-term hits instead of whole sections (SNIPPETS=false sends whole sections)
+SNIPPETS = os.environ.get("SNIPPETS", "true") == "true"
+SNIPPET_SENTENCES = int(os.environ.get("SNIPPET_SENTENCES", "3"))
+SNIPPET_WINDOWS = int(os.environ.get("SNIPPET_WINDOWS", "2"))
+SNIPPET_SEPARATOR = " \u2026 "
+
+# Hedging: start Bedrock too if Gemini has not answered within this many seconds (0 disables).
+# Gemini runs on the request's own thread; each hedge waits on one of HEDGE_WORKERS threads,
+# so size it to the asks that can be in flight at once (server threads, batch concurrency)
+GEMINI_HEDGE_SECONDS = float(os.environ.get("GEMINI_HEDGE_SECONDS", "4"))
+HEDGE_WORKERS = int(os.environ.get("HEDGE_WORKERS", str(max(int(os.environ.get("SERVER_THREADS", "32")),
+                                                            BATCH_CONCURRENCY))))
+# Circuit breaker: skip Gemini for a cooldown after this many consecutive 429s
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "3"))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get("GEMINI_BREAKER_COOLDOWN", "60"))
+
+# Keep in sync with tools/indexer.py: query and index must tokenize alike
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his how i in into is it its
+of on or our she so than that the their them then there these they this to was we
+were what when where which who whom why will with you your
+""".split())
+# Keep in sync with tools/indexer.py: sentence boundaries for books indexed without them
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]\u201d\u2019]*\s+(?=[A-Z0-9\"'(\[\u201c\u2018])")
+
+_LAZY_LOCK = threading.Lock()
+
+
+class _Lazy:
+    """A client or module built on first attribute access, then reused.
+
+    Cold starts only pay for what the first request touches: the bedrock
+    control-plane client is /health's, the HTTP session is Gemini's. Creation is
+    serialized because boto3's default session is not thread-safe.
+    """
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._target = None
+
+    def _get(self):
+        if self._target is None:
+            with _LAZY_LOCK:
+                if self._target is None:
+                    t0 = time.perf_counter()
+                    self._target = self._factory()
+                    _COLD_START.setdefault("lazy_ms", {})[self._name] = round((time.perf_counter() - t0) * 1000, 1)
+        return self._target
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+
+def _client(service, max_pool_connections=10, read_timeout=60, max_attempts=None, **kwargs):
+    """boto3 client with an explicit connection pool, timeouts and bounded retries."""
+    def create():
+        import boto3
+        from botocore.config import Config
+        config = Config(max_pool_connections=max_pool_connections, connect_timeout=AWS_CONNECT_TIMEOUT,
+                        read_timeout=read_timeout, tcp_keepalive=True,
+                        retries={"mode": "standard", "total_max_attempts": max_attempts or AWS_MAX_ATTEMPTS})
+        return boto3.client(service, config=config, **kwargs)
+    return _Lazy(service, create)
+
+
+def _abortable_pool(base):
+    """urllib3 pool class whose connections are handed to the running _GeminiCall,
+    so a hedge that has already answered can abort the request blocked on them."""
+    from urllib3.exceptions import EmptyPoolError
+
+    class AbortableConnection(base.ConnectionCls):
+        def connect(self):
+            super().connect()
+            call = _GEMINI_CALL.get()
+            if call is not None:
+                call.attach(self)
+
+    class AbortablePool(base):
+        ConnectionCls = AbortableConnection
+
+        def _get_conn(self, timeout=None):
+            call = _GEMINI_CALL.get()
+            if call is not None and call.aborted:
+                # Raised before a request is sent, so urllib3 does not retry it
+                raise EmptyPoolError(self, "Gemini call abandoned to its hedge")
+            conn = super()._get_conn(timeout)
+            if call is not None:
+                call.attach(conn)
+            return conn
+
+    return AbortablePool
+
+
+def _http_session():
+    """Keep-alive session for Gemini: connections (and their TLS handshakes) are
+    reused across requests and warm invocations. Connection errors and 5xx are
+    retried a bounded number of times; 429 is left to the circuit breaker."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=GEMINI_RETRIES, connect=GEMINI_RETRIES, read=0, backoff_factor=0.2,
+                  status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset({"POST"}),
+                  raise_on_status=False)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    adapter.poolmanager.pool_classes_by_scheme = {
+        scheme: _abortable_pool(pool) for scheme, pool in adapter.poolmanager.pool_classes_by_scheme.items()
+    }
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Reuse clients and connections across invocations
+s3 = _client("s3", max_pool_connections=S3_POOL_CONNECTIONS)
+# The governor retries Bedrock throttles itself, within the request deadline
+brt = _client("bedrock-runtime", max_pool_connections=BEDROCK_POOL_CONNECTIONS, max_attempts=1,
+              region_name=AWS_REGION)
+bedrock = _client("bedrock", read_timeout=10, region_name=AWS_REGION)
+http = _Lazy("http", _http_session)
+
+# Survives across warm invocations of the same container
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_LOCK = threading.Lock()
+_INDEX_CACHE_STATS = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "coalesced": 0}
+# In-flight revalidations/loads by cache key, so concurrent misses share one
+_INDEX_LOADS = {}
+_ANSWER_CACHE = OrderedDict()
+_ANSWER_CACHE_LOCK = threading.Lock()
+_GEMINI_BREAKER = {"rate_limited": 0, "open_until": 0.0}
+_GEMINI_BREAKER_LOCK = threading.Lock()
+# Book catalog from every toc.json: rows by book_id with their toc ETags, sorted rows, catalog ETag
+_CATALOG = {"checked_at": 0.0, "entries": {}, "books": [], "etag": None}
+# In-flight catalog rebuild by bucket, so concurrent requests after the TTL share one
+_CATALOG_LOADS = {}
+_CATALOG_LOCK = threading.Lock()
+_HEALTH = {"checked_at": 0.0, "checks": None, "refreshing": False}
+_HEALTH_LOCK = threading.Lock()
+_HEALTH_PROBE_LOCK = threading.Lock()
+# The running request's _Timings and deadline (time.monotonic()); pool threads get them through _carry_context
+_TIMINGS = contextvars.ContextVar("timings", default=None)
+_DEADLINE = contextvars.ContextVar("deadline", default=None)
+# The hedge of the Gemini call running on this thread, if any
+_GEMINI_CALL = contextvars.ContextVar("gemini_call", default=None)
+# Never shut down: a hedge whose Gemini call won is abandoned, not waited for
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+
+class _Timings:
+    """Per-request stage timers (ms) and counters.
+
+    Stages that run on several threads at once (books, section GETs, hedged
+    LLM calls) add up, so their sum can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, stage, ms):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def breakdown(self):
+        """{stage: ms} plus the wall-clock total so far."""
+        with self.lock:
+            stages = {stage: round(ms, 2) for stage, ms in self.stages.items()}
+        return dict(stages, total=round((time.perf_counter() - self.started) * 1000, 2))
+
+    def counts(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def emit(self, route, request_id, backend=None, stages=None):
+        """Print one CloudWatch EMF record; Lambda ships stdout to the log group as is."""
+        stages = stages or self.breakdown()
+        counters = self.counts()
+        metrics = [{"Name": f"{stage}_ms", "Unit": "Milliseconds"} for stage in stages]
+        metrics += [{"Name": name, "Unit": "Bytes" if name == "bytes_read" else "Count"} for name in counters]
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Route"], ["Route", "Backend"]] if backend else [["Route"]],
+                    "Metrics": metrics,
+                }],
+            },
+            "Route": route,
+            "RequestId": request_id,
+        }
+        # Claimed here, not per request: /health and /indexes emit nothing and must not use it up
+        cold_start = _claim_cold_start()
+        if cold_start:
+            # First emitted record of this container: also chart what init cost
+            metrics += [{"Name": name, "Unit": "Milliseconds"} for name in ("import_ms", "init_ms")]
+            record.update(ColdStart=True, import_ms=cold_start["import_ms"], init_ms=cold_start["init_ms"])
+        if backend:
+            record["Backend"] = backend
+        record.update({f"{stage}_ms": ms for stage, ms in stages.items()})
+        record.update(counters)
+        print(json.dumps(record), flush=True)
+
+
+def _server_timing(stages):
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in stages.items())
+
+
+def _timed_ok(body, timings, route, request_id, backend=None):
+    """_ok with the request's timings and counters in the body and a Server-Timing
+    header; also emits the EMF record."""
+    stages = timings.breakdown()
+    resp = _ok(dict(body, timings=stages, counters=timings.counts()))
+    resp["headers"]["Server-Timing"] = _server_timing(stages)
+    timings.emit(route, request_id, backend, stages)
+    return resp
+
+
+def _claim_cold_start():
+    """_COLD_START for the container's first EMF record, None afterwards."""
+    with _LAZY_LOCK:
+        if _COLD_START.get("claimed") or "init_ms" not in _COLD_START:
+            return None
+        _COLD_START["claimed"] = True
+        return dict(_COLD_START)
+
+
+@contextmanager
+def _stage(name):
+    """Time a block into the current request's timings (no-op outside a request)."""
+    timings = _TIMINGS.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(name, (time.perf_counter() - t0) * 1000)
+
+
+def _count(name, n=1):
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings.count(name, n)
+
 
-# Reuse clients across invocations
-s3 = boto3.client("s3")
-brt = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-bedrock = boto3.client("bedrock", region_name=AWS_REGION)
+def _carry_context(fn):
+    """fn bound to the caller's context (request timings), for running on pool threads."""
+    ctx = contextvars.copy_context()
+    return lambda *args: ctx.copy().run(fn, *args)
+
+
+def _read_body(obj):
+    data = obj["Body"].read()
+    _count("bytes_read", len(data))
+    return data
 
 
 def _parse_body(event):
@@ -60,72 +418,965 @@ def _validate_question(question):
     return question
 
 
+def _validate_books(body):
+    """Book IDs for /ask from book_ids, subject or book_id (in that order).
+
+    Returns (book_ids, error); a subject resolves through each book's toc.json.
+    """
+    if body.get("book_ids") is not None:
+        book_ids = body["book_ids"]
+        if not isinstance(book_ids, list) or not book_ids:
+            return None, "book_ids must be a non-empty list"
+    elif body.get("subject"):
+        book_ids = _books_for_subject(BUCKET, str(body["subject"]))
+        if not book_ids:
+            return None, f"No books for subject {body['subject']!r}"
+    else:
+        book_ids = [body.get("book_id", "philosophy")]
+    book_ids = list(dict.fromkeys(book_ids))
+    if not all(isinstance(b, str) and BOOK_ID_RE.match(b) for b in book_ids):
+        return None, "Invalid book_id"
+    if len(book_ids) > MAX_BOOKS:
+        return None, f"At most {MAX_BOOKS} books per question"
+    return book_ids, None
+
+
 def _ok(body, code=200):
     return {"statusCode": code,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps(body)}
 
 
-def _health_check():
-    """Health check with dependency validation"""
+def _probe(name, check):
+    """{"ok", "latency_ms"} for one dependency, plus a bare error code on failure.
+
+    /health is unauthenticated, so the exception text (which can carry account
+    IDs and role ARNs) is only logged.
+    """
+    t0 = time.perf_counter()
     try:
-        # Test S3 connectivity
-        s3.head_bucket(Bucket=BUCKET)
+        check()
+        error = None
+    except Exception as e:
+        log.warning(f"Health check dependency issue ({name}): {type(e).__name__}: {e}")
+        error = e.response.get("Error", {}).get("Code") if isinstance(e, ClientError) else None
+        error = error or type(e).__name__
+    result = {"ok": error is None, "latency_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    if error:
+        result["error"] = error
+    return result
 
-        # Test Bedrock connectivity
-        bedrock.list_foundation_models()
 
-        return {"ok": True, "version": os.environ.get("VERSION", "dev"), "dependencies": "healthy"}
-    except Exception as e:
-        log.warning(f"Health check dependency issue: {e}")
-        # Still return healthy if basic functionality works
-        return {"ok": True, "version": os.environ.get("VERSION", "dev"), "dependencies": "partial"}
+def _probe_dependencies():
+    """Check S3 and Bedrock once and store the result in the probe cache."""
+    checks = {
+        "s3": _probe("s3", lambda: s3.head_bucket(Bucket=BUCKET)),
+        "bedrock": _probe("bedrock", lambda: bedrock.list_foundation_models()),
+    }
+    with _HEALTH_LOCK:
+        _HEALTH.update(checked_at=time.time(), checks=checks, refreshing=False)
+    return checks
 
 
-def _top_sections(bucket, prefix, k, question=""):
-    # Get more sections initially for better coverage
-    resp = s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=k*3)
-    keys = [o["Key"] for o in resp.get("Contents", [])]
+def _dependency_checks(max_age, background=False):
+    """(checks, age in seconds) from the probe cache.
 
-    # Fetch all sections
-    all_sections = []
-    for key in keys:
+    A result older than max_age is re-probed; with background it is served
+    stale while one thread refreshes it, otherwise the caller waits. Either
+    way at most one probe runs at a time.
+    """
+    with _HEALTH_LOCK:
+        checks, checked_at = _HEALTH["checks"], _HEALTH["checked_at"]
+        stale = checks is None or time.time() - checked_at > max_age
+        refresh = background and stale and checks is not None and not _HEALTH["refreshing"]
+        if refresh:
+            _HEALTH["refreshing"] = True
+    if refresh:
+        # In Lambda the thread is frozen between invocations and finishes on a later one
+        threading.Thread(target=_probe_dependencies, daemon=True).start()
+    elif stale and not (background and checks is not None):
+        with _HEALTH_PROBE_LOCK:
+            with _HEALTH_LOCK:
+                checks, checked_at = _HEALTH["checks"], _HEALTH["checked_at"]
+            if checks is None or time.time() - checked_at > max_age:
+                checks, checked_at = _probe_dependencies(), time.time()
+    return checks, max(0.0, time.time() - checked_at)
+
+
+def _health_check(mode=None):
+    """(body, status) for GET /health.
+
+    mode=live touches nothing; the default reports dependencies from the probe
+    cache (HEALTH_PROBE_TTL, refreshed in the background); mode=ready re-probes
+    unless the last check is under HEALTH_READY_MIN_SECONDS old, and is 503
+    when a dependency fails.
+    """
+    mode = mode if mode in ("live", "ready") else "cached"
+    body = {"ok": True, "version": os.environ.get("VERSION", "dev"), "mode": mode,
+            "index_cache": _index_cache_stats(), "cold_start": _cold_start_stats()}
+    if mode == "live":
+        return body, 200
+
+    if mode == "ready":
+        checks, age = _dependency_checks(HEALTH_READY_MIN_SECONDS)
+    else:
+        checks, age = _dependency_checks(HEALTH_PROBE_TTL, background=True)
+    healthy = all(check["ok"] for check in checks.values())
+    body.update(dependencies="healthy" if healthy else "partial", checks=checks, checked_age_s=round(age, 1))
+    if mode == "ready" and not healthy:
+        # Still healthy for liveness if basic functionality works; not ready to serve
+        body["ok"] = False
+        return body, 503
+    return body, 200
+
+
+def _cold_start_stats():
+    return {k: v for k, v in _COLD_START.items() if k != "claimed"}
+
+
+def _book_base(prefix):
+    """indexes/<book>/sections/ -> indexes/<book>/"""
+    base = prefix.rstrip("/")
+    if base.endswith("/sections"):
+        base = base[:-len("/sections")]
+    return base + "/"
+
+
+def _load_shard(bucket, prefix):
+    """Load every section of a book from its packed shard in one GET.
+
+    Returns a list of (key, section) or None when the book has no shard.
+    """
+    try:
+        with _stage("s3_fetch"):
+            data = _read_body(s3.get_object(Bucket=bucket, Key=_book_base(prefix) + SHARD_NAME))
+    except ClientError as e:
+        log.info(f"No shard under {_book_base(prefix)}: {e.response.get('Error', {}).get('Code')}")
+        return None
+
+    shard = json.loads(data)
+    blob = shard.get("text", "")
+    sections = []
+    for entry in shard.get("sections", []):
+        start = entry["offset"]
+        section = {k: v for k, v in entry.items() if k not in ("offset", "length")}
+        section.update({
+            "book_id": shard.get("book_id"),
+            "subject": shard.get("subject"),
+            "text": blob[start:start + entry["length"]],
+        })
+        sections.append((f"{prefix}{entry['section_id']}.json", section))
+    return sections
+
+
+def _binary_path(base):
+    """Where _load_binary keeps a book's index.bin; its ETag sits next to it in path + ".etag"."""
+    return os.path.join(INDEX_DIR, base.strip("/").replace("/", "_") + ".bin")
+
+
+def _load_binary(bucket, prefix):
+    """mmap the book's index.bin from INDEX_DIR, downloading it only when the copy
+    there is missing or its stored ETag no longer matches S3.
+
+    Returns (sections, blob, spans) where sections carry metadata only; text is
+    sliced from the mapping on demand. None when the book has no index.bin.
+    """
+    base = _book_base(prefix)
+    path = _binary_path(base)
+    try:
+        with _stage("revalidate"):
+            etag = s3.head_object(Bucket=bucket, Key=base + BINARY_NAME).get("ETag")
+    except ClientError as e:
+        log.info(f"No {BINARY_NAME} under {base}: {e.response.get('Error', {}).get('Code')}")
+        return None
+    f = None
+    try:
+        with open(path + ".etag") as version:
+            if etag is not None and version.read() == etag:
+                f = open(path, "rb")
+    except FileNotFoundError:
+        pass  # not downloaded yet, or evicted since
+
+    if f is None:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
         try:
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            section = json.loads(obj["Body"].read())
-            all_sections.append((key, section))
-        except Exception:
+            with _stage("s3_fetch"):
+                s3.download_file(bucket, base + BINARY_NAME, tmp)
+            _count("bytes_read", os.path.getsize(tmp))
+        except ClientError as e:
+            log.info(f"No {BINARY_NAME} under {base}: {e.response.get('Error', {}).get('Code')}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        # Opened before the rename so an eviction can't unlink it first; replaced
+        # atomically, so a previous mapping keeps its own (unlinked) inode
+        f = open(tmp, "rb")
+        os.replace(tmp, path)
+        with open(tmp, "w") as version:
+            version.write(etag or "")
+        os.replace(tmp, path + ".etag")
+
+    with f:
+        blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, _, count, meta_len = BINARY_HEADER.unpack_from(blob, 0)
+    if magic != BINARY_MAGIC:
+        log.warning(f"Ignoring {base}{BINARY_NAME}: bad magic {magic!r}")
+        blob.close()
+        return None
+
+    table_start = BINARY_HEADER.size
+    meta_start = table_start + count * BINARY_SPAN.size
+    blob_start = meta_start + meta_len
+    meta = json.loads(blob[meta_start:blob_start].decode("utf-8"))
+    spans = [(blob_start + offset, length)
+             for offset, length in BINARY_SPAN.iter_unpack(blob[table_start:meta_start])]
+
+    sections = []
+    sentences = meta.get("sentences") or itertools.repeat(None)
+    for (section_id, title, page_start, page_end), starts in zip(meta.get("sections", []), sentences):
+        sections.append((f"{prefix}{section_id}.json", {
+            "book_id": meta.get("book_id"),
+            "subject": meta.get("subject"),
+            "section_id": section_id,
+            "title": title,
+            "page_start": page_start,
+            "page_end": page_end,
+            "sentences": starts,
+        }))
+    return sections, blob, spans
+
+
+def _fetch_section(bucket, key):
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        return key, json.loads(_read_body(obj))
+    except Exception:
+        return None
+
+
+def _fetch_sections(bucket, keys):
+    """GET section JSONs concurrently, keeping key order; failed keys are dropped."""
+    if len(keys) <= 1 or FETCH_WORKERS <= 1:
+        results = [_fetch_section(bucket, key) for key in keys]
+    else:
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(keys))) as pool:
+            results = list(pool.map(_carry_context(lambda key: _fetch_section(bucket, key)), keys))
+    return [r for r in results if r is not None]
+
+
+def _list_section_keys(bucket, prefix):
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []) if o["Key"].endswith(".json"))
+    return keys
+
+
+def _load_section_objects(bucket, prefix):
+    """Legacy layout: list the whole sections/ prefix and GET every section JSON."""
+    with _stage("s3_list"):
+        keys = _list_section_keys(bucket, prefix)
+    with _stage("s3_fetch"):
+        return _fetch_sections(bucket, keys)
+
+
+def _tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _build_bm25(sections):
+    """In-process equivalent of the indexer's bm25.json, for older books."""
+    postings, doc_len = {}, []
+    for doc, (_, section) in enumerate(sections):
+        counts = {}
+        tokens = _tokenize(section.get("text") or "")
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            postings.setdefault(tok, []).append([doc, tf])
+        doc_len.append(len(tokens))
+    n = len(sections)
+    return {
+        "doc_ids": [section.get("section_id") for _, section in sections],
+        "doc_len": doc_len,
+        "avgdl": (sum(doc_len) / n) if n else 0.0,
+        "idf": {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()},
+        "postings": postings,
+    }
+
+
+def _load_bm25(bucket, prefix):
+    try:
+        with _stage("s3_fetch"):
+            data = _read_body(s3.get_object(Bucket=bucket, Key=_book_base(prefix) + BM25_NAME))
+    except ClientError:
+        return None
+    return json.loads(data)
+
+
+def _bm25_scores(index, question):
+    """{doc: score} for docs sharing a term with question; only those terms' postings are touched."""
+    avgdl = index["avgdl"] or 1.0
+    doc_len = index["doc_len"]
+    scores = {}
+    for term in set(_tokenize(question)):
+        idf = index["idf"].get(term)
+        if idf is None:
             continue
+        for doc, tf in index["postings"][term]:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc] / avgdl)
+            scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return scores
 
-    # Simple keyword scoring if question provided
-    if question:
-        keywords = set(question.lower().split())
-        scored = []
-        for key, section in all_sections:
-            text = (section.get("text") or "").lower()
-            score = sum(1 for kw in keywords if kw in text and len(kw) > 3)
-            scored.append((score, key, section))
-        scored.sort(reverse=True)
-        # Take top k by score, but ensure we get at least some early sections
-        top_scored = scored[:k-2] if len(scored) > k else scored
-        early_sections = [(0, k, s) for k, s in all_sections[:2]]
-        combined = early_sections + top_scored
-        return [k for _, k, _ in combined[:k]], [s for _, _, s in combined[:k]]
-
-    # Fallback: just return first k
-    return keys[:k], [s for _, s in all_sections[:k]]
 
+def _bm25_rank(index, question, k):
+    """Top k (doc, score) pairs."""
+    return heapq.nlargest(k, _bm25_scores(index, question).items(), key=lambda kv: kv[1])
+
+
+def _load_lsa(bucket, prefix):
+    """The book's lsa.bin as numpy views over one GET, or None (no file, no numpy, or bm25 mode)."""
+    if np is None or RETRIEVAL_MODE == "bm25":
+        return None
+    base = _book_base(prefix)
+    try:
+        with _stage("s3_fetch"):
+            data = _read_body(s3.get_object(Bucket=bucket, Key=base + LSA_NAME))
+    except ClientError:
+        return None
+    magic, _, doc_count, term_count, dims, meta_len = LSA_HEADER.unpack_from(data, 0)
+    if magic != LSA_MAGIC:
+        log.warning(f"Ignoring {base}{LSA_NAME}: bad magic {magic!r}")
+        return None
+    meta = json.loads(data[LSA_HEADER.size:LSA_HEADER.size + meta_len])
+    matrix = np.frombuffer(data, dtype="<f4", count=(doc_count + term_count) * dims,
+                           offset=LSA_HEADER.size + meta_len).reshape(-1, dims)
+    return {
+        "doc_ids": meta["doc_ids"],
+        "terms": {term: row for row, term in enumerate(meta["terms"])},
+        "idf": np.asarray(meta["idf"], dtype=np.float32),
+        "docs": matrix[:doc_count],
+        "vectors": matrix[doc_count:],
+    }
+
+
+def _lsa_query(lsa, question):
+    """Unit-length LSA vector of the folded-in question, or None when no query term
+    is in the LSA vocabulary."""
+    counts = {}
+    for term in _tokenize(question):
+        row = lsa["terms"].get(term)
+        if row is not None:
+            counts[row] = counts.get(row, 0) + 1
+    if not counts:
+        return None
+    rows = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    query = ((1 + np.log(tf)) * lsa["idf"][rows]) @ lsa["vectors"][rows]
+    norm = np.linalg.norm(query)
+    if not norm:
+        return None
+    return query / norm
+
+
+def _lsa_scores(lsa, questions):
+    """Cosine of each question against every section's LSA vector, with one matrix
+    product for the whole list; None for questions outside the vocabulary."""
+    queries = [_lsa_query(lsa, question) for question in questions]
+    found = [i for i, query in enumerate(queries) if query is not None]
+    scores = [None] * len(questions)
+    if found:
+        cosines = lsa["docs"] @ np.stack([queries[i] for i in found], axis=1)
+        for col, i in enumerate(found):
+            scores[i] = cosines[:, col]
+    return scores
+
+
+def _rank_sections(book, question, k, cosine=None):
+    """(position, score) of the k best sections for question under RETRIEVAL_MODE.
+
+    hybrid adds LSA_WEIGHT x cosine to (1 - LSA_WEIGHT) x BM25 scaled to the best
+    hit; both are scored over the whole book and cut with argpartition. Books
+    without LSA vectors, and questions outside their vocabulary, use BM25 alone.
+    cosine may be passed in from a batched _lsa_scores.
+    """
+    lsa = book.get("lsa")
+    if cosine is None and lsa is not None:
+        cosine = _lsa_scores(lsa, [question])[0]
+    if cosine is None:
+        return [(book["positions"][doc], score) for doc, score in _bm25_rank(book["bm25"], question, k)]
+
+    scores = np.zeros(len(book["sections"]), dtype=np.float32)
+    weight = LSA_WEIGHT if RETRIEVAL_MODE == "hybrid" else 1.0
+    scores[lsa["positions"]] = weight * np.maximum(cosine, 0)
+    if RETRIEVAL_MODE == "hybrid":
+        bm25 = _bm25_scores(book["bm25"], question)
+        if bm25:
+            docs = np.fromiter(bm25.keys(), dtype=np.intp, count=len(bm25))
+            values = np.fromiter(bm25.values(), dtype=np.float32, count=len(bm25))
+            scores[np.asarray(book["positions"])[docs]] += (1 - weight) * values / values.max()
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(pos), float(scores[pos])) for pos in top if scores[pos] > 0]
+
+
+def _load_book(bucket, prefix):
+    """Everything retrieval needs for one book, straight from S3."""
+    book = {"sections": None, "blob": None, "spans": None}
+    if INDEX_MODE in ("auto", "binary"):
+        loaded = _load_binary(bucket, prefix)
+        if loaded is not None:
+            book["sections"], book["blob"], book["spans"] = loaded
+        elif INDEX_MODE == "binary":
+            book["sections"] = []
+    if book["sections"] is None and INDEX_MODE in ("auto", "shard"):
+        book["sections"] = _load_shard(bucket, prefix)
+        if book["sections"] is None and INDEX_MODE == "shard":
+            book["sections"] = []
+    if book["sections"] is None:
+        book["sections"] = _load_section_objects(bucket, prefix)
+    sections = book["sections"]
+
+    by_id = {section.get("section_id"): i for i, (_, section) in enumerate(sections)}
+    index = _load_bm25(bucket, prefix)
+    positions = None  # bm25 doc number -> position in sections
+    if index is not None and all(doc_id in by_id for doc_id in index["doc_ids"]):
+        positions = [by_id[doc_id] for doc_id in index["doc_ids"]]
+    if positions is None:
+        index = _build_bm25([_book_section(book, i) for i in range(len(sections))])
+        positions = list(range(len(sections)))
+
+    lsa = _load_lsa(bucket, prefix)
+    if lsa is not None:
+        if all(doc_id in by_id for doc_id in lsa["doc_ids"]):
+            lsa["positions"] = np.array([by_id[doc_id] for doc_id in lsa["doc_ids"]], dtype=np.intp)
+        else:
+            log.warning(f"Ignoring {_book_base(prefix)}{LSA_NAME}: sections do not match")
+            lsa = None
+
+    book.update(bm25=index, positions=positions, lsa=lsa)
+    return book
+
+
+def _book_section(book, pos):
+    """(key, section) at pos, slicing text out of the mmap'd blob if there is one."""
+    key, section = book["sections"][pos]
+    if book.get("blob") is None:
+        return key, section
+    start, length = book["spans"][pos]
+    return key, dict(section, text=book["blob"][start:start + length].decode("utf-8"))
+
+
+def _book_nbytes(book):
+    """Rough resident size of a cached book: in-memory section text, postings and LSA vectors.
+
+    Text in an mmap'd index.bin is paged in by the OS and not counted.
+    """
+    text = sum(len(section.get("text") or "") for _, section in book["sections"])
+    postings = sum(len(p) for p in book["bm25"]["postings"].values())
+    lsa = book.get("lsa")
+    vectors = lsa["docs"].nbytes + lsa["vectors"].nbytes + 64 * len(lsa["terms"]) if lsa else 0
+    return text + 64 * postings + 256 * len(book["sections"]) + vectors
+
+
+def _toc_version(bucket, base):
+    """ETag of the book's toc.json; changes whenever the indexer re-runs."""
+    try:
+        with _stage("revalidate"):
+            return s3.head_object(Bucket=bucket, Key=base + "toc.json").get("ETag")
+    except ClientError:
+        return None
+
+
+def _book_index(bucket, prefix):
+    """Per-book index data from the warm LRU cache, reloading when toc.json changes.
+
+    Revalidation and loading are single-flight per book: concurrent requests for
+    a book that is not fresh wait for the one thread doing the work and share its
+    result (or its exception).
+    """
+    cache_key = (bucket, _book_base(prefix))
+    now = time.time()
+    with _INDEX_CACHE_LOCK:
+        entry = _INDEX_CACHE.get(cache_key)
+        if entry and now - entry["checked_at"] < INDEX_REVALIDATE_SECONDS:
+            _INDEX_CACHE.move_to_end(cache_key)
+            _INDEX_CACHE_STATS["hits"] += 1
+            return entry["book"]
+        pending = _INDEX_LOADS.get(cache_key)
+        if pending is not None:
+            _INDEX_CACHE_STATS["coalesced"] += 1
+        else:
+            load = _INDEX_LOADS[cache_key] = Future()
+    if pending is not None:
+        return pending.result()
+
+    try:
+        book = _refresh_book_index(bucket, prefix, cache_key, entry, now)
+    except BaseException as e:
+        load.set_exception(e)
+        raise
+    else:
+        load.set_result(book)
+        return book
+    finally:
+        with _INDEX_CACHE_LOCK:
+            _INDEX_LOADS.pop(cache_key, None)
+
+
+def _refresh_book_index(bucket, prefix, cache_key, entry, now):
+    """The slow half of _book_index: revalidate entry against toc.json, else load the book."""
+    version = _toc_version(bucket, cache_key[1])
+    with _INDEX_CACHE_LOCK:
+        if entry and version is not None and entry["version"] == version:
+            entry["checked_at"] = now
+            _INDEX_CACHE.move_to_end(cache_key)
+            _INDEX_CACHE_STATS["hits"] += 1
+            _INDEX_CACHE_STATS["revalidations"] += 1
+            return entry["book"]
+        _INDEX_CACHE_STATS["misses"] += 1
+
+    book = _load_book(bucket, prefix)
+    entry = {"book": book, "version": version, "checked_at": now, "bytes": _book_nbytes(book)}
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE[cache_key] = entry
+        _INDEX_CACHE.move_to_end(cache_key)
+        while len(_INDEX_CACHE) > 1 and sum(e["bytes"] for e in _INDEX_CACHE.values()) > INDEX_CACHE_BYTES:
+            (_, base), evicted = _INDEX_CACHE.popitem(last=False)
+            _INDEX_CACHE_STATS["evictions"] += 1
+            if evicted["book"].get("blob") is not None:
+                # /tmp is small on Lambda; the mapping stays valid on its unlinked inode until closed
+                _remove_binary(_binary_path(base))
+    return book
+
+
+def _remove_binary(path):
+    for name in (path, path + ".etag"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def _index_cache_stats():
+    with _INDEX_CACHE_LOCK:
+        return dict(_INDEX_CACHE_STATS,
+                    entries=len(_INDEX_CACHE),
+                    bytes=sum(e["bytes"] for e in _INDEX_CACHE.values()))
+
+
+def _bm25_reference(index, question):
+    """What a section matching every query term once scores under BM25: the sum of
+    the terms' IDFs, with terms the book lacks at the IDF of an unseen term.
+
+    Dividing by this puts BM25-only books on the same 0..1 footing as blended
+    scores, without lifting a book that merely shares one common word.
+    """
+    unseen = math.log(1 + (len(index["doc_len"]) + 0.5) / 0.5)
+    return sum(index["idf"].get(term, unseen) for term in set(_tokenize(question))) or 1.0
+
+
+def _ranked_sections(bucket, prefix, k, questions):
+    """Per question, [(score, key, section)] best first, with scores comparable
+    across books: blended scores as they are (already 0..1), BM25-only scores over
+    _bm25_reference capped at 1.0. The book is loaded once and LSA-scored in one product."""
+    book = _book_index(bucket, prefix)
+    _count("sections_loaded", len(book["sections"]))
+    lsa = book.get("lsa")
+    with _stage("score"):
+        cosines = _lsa_scores(lsa, questions) if lsa is not None else [None] * len(questions)
+        ranked_all = [_rank_sections(book, question, k, cosine) if question else []
+                      for question, cosine in zip(questions, cosines)]
+
+    results = []
+    for question, cosine, ranked in zip(questions, cosines, ranked_all):
+        if ranked:
+            reference = _bm25_reference(book["bm25"], question) if cosine is None else 1.0
+            picked = []
+            with _stage("snippets"):
+                for pos, score in ranked:
+                    key, section = _book_section(book, pos)
+                    picked.append((min(score / reference, 1.0), key,
+                                   _snippet(section, question, book["bm25"].get("idf", {}))))
+            results.append(picked)
+        else:
+            # Fallback: just return first k
+            results.append([(0.0,) + _book_section(book, pos) for pos in range(min(k, len(book["sections"])))])
+    return results
+
+
+def _sentence_starts(text):
+    return [m.end() for m in SENTENCE_END_RE.finditer(text) if m.end() < len(text)]
+
+
+def _snippet(section, question, idf):
+    """section cut down to the sentence windows that best match the question.
+
+    Each window of up to SNIPPET_SENTENCES consecutive sentences scores the IDF
+    of the distinct query terms it contains; the best SNIPPET_WINDOWS windows
+    that do not overlap are kept in text order, joined by an ellipsis, and their
+    character spans recorded. Sections with no term hit (e.g. LSA-only matches)
+    or whose windows would cover most of the text are returned whole.
+    """
+    text = _section_text(section)
+    terms = set(_tokenize(question))
+    if not SNIPPETS or not text or not terms:
+        return section
+    starts = section.get("sentences")
+    if starts is None:
+        starts = _sentence_starts(text)
+    bounds = [0] + list(starts) + [len(text)]
+    hits = [terms.intersection(_tokenize(text[a:b])) for a, b in zip(bounds, bounds[1:])]
+    if len(hits) <= SNIPPET_SENTENCES:
+        return section
+
+    scored = []
+    for i in range(len(hits) - SNIPPET_SENTENCES + 1):
+        window = set().union(*hits[i:i + SNIPPET_SENTENCES])
+        if window:
+            scored.append((-sum(idf.get(t, 1.0) for t in window), i))
+    picked = []
+    for _, i in sorted(scored):
+        if all(abs(i - j) >= SNIPPET_SENTENCES for j in picked):
+            picked.append(i)
+        if len(picked) == SNIPPET_WINDOWS:
+            break
+    if not picked:
+        return section
+
+    spans = []
+    for i in sorted(picked):
+        start, end = bounds[i], bounds[i + SNIPPET_SENTENCES]
+        if spans and spans[-1][1] == start:
+            spans[-1][1] = end  # adjacent windows read as one passage
+        else:
+            spans.append([start, end])
+    if sum(end - start for start, end in spans) > 0.8 * len(text):
+        return section
+    snippet = SNIPPET_SEPARATOR.join(text[start:end].strip() for start, end in spans)
+    return dict(section, text=snippet, spans=spans)
+
+
+def _top_sections(bucket, prefix, k, question=""):
+    picked = _ranked_sections(bucket, prefix, k, [question])[0]
+    return [key for _, key, _ in picked], [s for _, _, s in picked]
+
+
+def _top_sections_batch(bucket, book_ids, k, questions):
+    """Global top k across books for each question, as (keys, sections) per question.
+
+    Each book is loaded and ranked on its own thread, so latency tracks the
+    slowest book rather than the sum. The per-book lists are already best-first
+    with normalized scores, so a heap merge yields the global order; ties keep
+    book order.
+    """
+    prefixes = [f"indexes/{book_id}/sections/" for book_id in book_ids]
+    if len(prefixes) == 1:
+        per_book = [_ranked_sections(bucket, prefixes[0], k, questions)]
+    else:
+        with ThreadPoolExecutor(max_workers=len(prefixes)) as pool:
+            rank = _carry_context(lambda prefix: _ranked_sections(bucket, prefix, k, questions))
+            per_book = list(pool.map(rank, prefixes))
+    results = []
+    for i in range(len(questions)):
+        picked = list(itertools.islice(heapq.merge(*(ranked[i] for ranked in per_book), key=lambda hit: -hit[0]), k))
+        results.append(([key for _, key, _ in picked], [s for _, _, s in picked]))
+    return results
+
+
+def _top_sections_federated(bucket, book_ids, k, question):
+    """Global top k across books for one question; see _top_sections_batch."""
+    if len(book_ids) == 1:
+        return _top_sections(bucket, f"indexes/{book_ids[0]}/sections/", k, question)
+    return _top_sections_batch(bucket, book_ids, k, [question])[0]
+
+
+def _catalog_entry(bucket, book_id, cached):
+    """Catalog row for one book from its toc.json; cached (row, etag) is reused on 304."""
+    kwargs = {"IfNoneMatch": cached[1]} if cached else {}
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=f"indexes/{book_id}/toc.json", **kwargs)
+        toc = json.loads(_read_body(obj))
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if cached and code in ("304", "NotModified"):
+            return cached
+        if code in ("404", "NoSuchKey"):
+            return None
+        # A transient error (SlowDown, 5xx) must not drop the book until the next rebuild
+        log.warning(f"Catalog: keeping the previous row for {book_id}: {e}")
+        return cached
+    except Exception as e:
+        log.warning(f"Catalog: keeping the previous row for {book_id}: {e}")
+        return cached
+    sections = toc.get("sections", [])
+    sizes = [sec.get("bytes") for sec in sections]
+    row = {
+        "book_id": book_id,
+        "subject": toc.get("subject"),
+        "source_pdf": toc.get("source_pdf"),
+        "sections": len(sections),
+        "page_start": min((sec["page_start"] for sec in sections), default=None),
+        "page_end": max((sec["page_end"] for sec in sections), default=None),
+        "created_at": toc.get("created_at"),
+        # text bytes; older toc.json files do not record them
+        "bytes": sum(sizes) if sizes and None not in sizes else None,
+    }
+    return row, obj.get("ETag")
+
+
+def _catalog(bucket):
+    """(books, etag): one row per book with a toc.json, sorted by book_id.
+
+    Rebuilt at most every CATALOG_TTL_SECONDS by listing indexes/ one level
+    deep and conditionally re-reading each toc.json (unchanged ones cost a 304).
+    The rebuild is single-flight: concurrent requests wait for it.
+    """
+    with _CATALOG_LOCK:
+        if time.time() - _CATALOG["checked_at"] < CATALOG_TTL_SECONDS:
+            return _CATALOG["books"], _CATALOG["etag"]
+        entries = dict(_CATALOG["entries"])
+        pending = _CATALOG_LOADS.get(bucket)
+        if pending is None:
+            load = _CATALOG_LOADS[bucket] = Future()
+    if pending is not None:
+        return pending.result()
+
+    try:
+        result = _rebuild_catalog(bucket, entries)
+    except BaseException as e:
+        load.set_exception(e)
+        raise
+    else:
+        load.set_result(result)
+        return result
+    finally:
+        with _CATALOG_LOCK:
+            _CATALOG_LOADS.pop(bucket, None)
+
+
+def _rebuild_catalog(bucket, entries):
+    """The slow half of _catalog; entries are the previous rows and ETags by book_id."""
+    book_ids = []
+    with _stage("s3_list"):
+        pages = s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix="indexes/", Delimiter="/")
+        for page in pages:
+            book_ids.extend(p["Prefix"].split("/")[1] for p in page.get("CommonPrefixes", []))
+    with _stage("s3_fetch"), ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(book_ids)))) as pool:
+        entry_of = _carry_context(lambda book_id: _catalog_entry(bucket, book_id, entries.get(book_id)))
+        entries = {book_id: entry for book_id, entry in zip(book_ids, pool.map(entry_of, book_ids)) if entry}
+
+    books = [entries[book_id][0] for book_id in sorted(entries)]
+    etag = '"' + hashlib.sha256(json.dumps(books, sort_keys=True).encode("utf-8")).hexdigest()[:32] + '"'
+    with _CATALOG_LOCK:
+        _CATALOG.update(checked_at=time.time(), entries=entries, books=books, etag=etag)
+    return books, etag
 
-def _ask_with_gemini(question, sections):
-    """Use Gemini API for answer generation"""
-    if not GEMINI_API_KEY:
-        return "[No Gemini API key configured]"
 
-    context = "\n\n---\n\n".join(
-        s.get("text") or s.get("content", "") or "" for s in sections
-    )[:30000]
+def _books_for_subject(bucket, subject):
+    """Book IDs whose toc.json subject matches (case-insensitively), from the catalog."""
+    wanted = subject.strip().lower()
+    return [book["book_id"] for book in _catalog(bucket)[0] if (book["subject"] or "").lower() == wanted]
 
-    prompt = f"""Use only the provided curriculum excerpts to answer the question.
+
+def _header(event, name):
+    """Request header, case-insensitively (API Gateway v1 keeps the client's case)."""
+    for key, value in ((event or {}).get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _indexes(event):
+    """GET /indexes: a page of the book catalog, with ETag/If-None-Match."""
+    params = (event or {}).get("queryStringParameters") or {}
+    try:
+        limit = min(max(int(params.get("limit", CATALOG_PAGE_SIZE)), 1), CATALOG_MAX_PAGE_SIZE)
+    except ValueError:
+        return _ok({"error": "limit must be an integer"}, 400)
+    cursor = params.get("cursor") or ""
+    subject = (params.get("subject") or "").strip().lower()
+
+    books, etag = _catalog(BUCKET)
+    if subject:
+        books = [book for book in books if (book["subject"] or "").lower() == subject]
+    # The cursor is the last book_id of the previous page; ids are sorted
+    page = [book for book in books if book["book_id"] > cursor][:limit + 1]
+    next_cursor = page[limit - 1]["book_id"] if len(page) > limit else None
+    page = page[:limit]
+
+    # A page changes only with the catalog or the query
+    query = f"{cursor}|{limit}|{subject}"
+    page_etag = etag[:-1] + "-" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:8] + '"'
+    headers = {"Content-Type": "application/json", "ETag": page_etag,
+               "Cache-Control": f"max-age={int(CATALOG_TTL_SECONDS)}"}
+    if _header(event, "if-none-match") == page_etag:
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": headers, "body": json.dumps({
+        "bucket": BUCKET, "prefix": "indexes/", "count": len(page), "total": len(books),
+        "books": page, "next_cursor": next_cursor})}
+
+
+def _section_text(section):
+    return section.get("text") or section.get("content", "") or ""
+
+
+def _estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _pack_context(sections, budget_tokens):
+    """Indices of the sections that go into a prompt, in rank order.
+
+    Sections arrive best-first and are taken greedily while they fit the token
+    budget. One that does not fit is skipped in favour of later, smaller ones
+    rather than cut mid-sentence. Duplicates are skipped.
+    """
+    picked, seen, used = [], set(), 0
+    separator = _estimate_tokens(CONTEXT_SEPARATOR)
+    for i, section in enumerate(sections):
+        text = _section_text(section)
+        fingerprint = hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+        if not text or fingerprint in seen or section.get("section_id") in seen:
+            continue
+        cost = _estimate_tokens(text) + separator
+        if used + cost > budget_tokens:
+            continue
+        seen.update({fingerprint, section.get("section_id")} - {None})
+        picked.append(i)
+        used += cost
+    return picked
+
+
+def _context_budget(backend):
+    return GEMINI_CONTEXT_TOKENS if backend == "gemini" else BEDROCK_CONTEXT_TOKENS
+
+
+def _packed_context(sections, backend):
+    return CONTEXT_SEPARATOR.join(_section_text(sections[i]) for i in _pack_context(sections, _context_budget(backend)))
+
+
+def _sources(keys, sections, backend):
+    """The sections the answering backend actually saw, tagged with their book."""
+    return [dict({"s3_key": keys[i], "book_id": _key_book(keys[i])},
+                 **({"spans": sections[i]["spans"]} if sections[i].get("spans") else {}))
+            for i in _pack_context(sections, _context_budget(backend))]
+
+
+def _key_book(key):
+    """Book ID of an indexes/<book_id>/sections/... key."""
+    parts = key.split("/")
+    return parts[1] if len(parts) > 2 and parts[0] == "indexes" else None
+
+
+def _normalize_question(question):
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def _answer_cache_key(book_id, question, keys, sections):
+    """book_id + normalized question + the exact section set that was retrieved.
+
+    Section text is hashed along with the ID so an incremental re-index only
+    invalidates answers built on sections whose content changed.
+    """
+    section_ids = sorted(
+        f"{k.rsplit('/', 1)[-1]}:{hashlib.sha1(_section_text(s).encode('utf-8')).hexdigest()}"
+        for k, s in zip(keys, sections)
+    )
+    sections_hash = hashlib.sha256("\n".join(section_ids).encode("utf-8")).hexdigest()
+    raw = json.dumps([book_id, _normalize_question(question), sections_hash])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _answer_cache_get(key):
+    """Cached {"answer", "sources"} for key, or None."""
+    now = time.time()
+    with _ANSWER_CACHE_LOCK:
+        hit = _ANSWER_CACHE.get(key)
+        if hit and hit[0] > now:
+            _ANSWER_CACHE.move_to_end(key)
+            return hit[1]
+        _ANSWER_CACHE.pop(key, None)
+
+    entry = None
+    try:
+        if ANSWER_CACHE_PREFIX:
+            obj = s3.get_object(Bucket=BUCKET, Key=f"{ANSWER_CACHE_PREFIX.rstrip('/')}/{key}.json")
+            entry = json.loads(_read_body(obj))
+        elif ANSWER_CACHE_DIR:
+            path = os.path.join(ANSWER_CACHE_DIR, f"{key}.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+    except ClientError:
+        pass
+    except Exception as e:
+        log.warning(f"Answer cache read failed: {e}")
+    if not entry or entry.get("created_at", 0) + ANSWER_CACHE_TTL <= now:
+        return None
+
+    hit = {"answer": entry["answer"], "sources": entry.get("sources", [])}
+    _answer_cache_remember(key, hit, entry["created_at"] + ANSWER_CACHE_TTL)
+    return hit
+
+
+def _answer_cache_remember(key, hit, expires_at):
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE[key] = (expires_at, hit)
+        _ANSWER_CACHE.move_to_end(key)
+        while len(_ANSWER_CACHE) > ANSWER_CACHE_SIZE:
+            _ANSWER_CACHE.popitem(last=False)
+
+
+def _answer_cache_put(key, answer, sources):
+    # Error and throttle placeholders ("[...]") are never cached
+    if not answer or answer.startswith("["):
+        return
+    now = time.time()
+    _answer_cache_remember(key, {"answer": answer, "sources": sources}, now + ANSWER_CACHE_TTL)
+
+    entry = json.dumps({"answer": answer, "sources": sources, "created_at": now})
+    try:
+        if ANSWER_CACHE_PREFIX:
+            s3.put_object(Bucket=BUCKET, Key=f"{ANSWER_CACHE_PREFIX.rstrip('/')}/{key}.json",
+                          Body=entry.encode("utf-8"), ContentType="application/json")
+        elif ANSWER_CACHE_DIR:
+            os.makedirs(ANSWER_CACHE_DIR, exist_ok=True)
+            with open(os.path.join(ANSWER_CACHE_DIR, f"{key}.json"), "w", encoding="utf-8") as f:
+                f.write(entry)
+    except Exception as e:
+        log.warning(f"Answer cache write failed: {e}")
+
+
+def _gemini_available():
+    with _GEMINI_BREAKER_LOCK:
+        return time.time() >= _GEMINI_BREAKER["open_until"]
+
+
+def _gemini_record(status_code):
+    """Feed the circuit breaker with the outcome of a Gemini call."""
+    with _GEMINI_BREAKER_LOCK:
+        if status_code != 429:
+            _GEMINI_BREAKER["rate_limited"] = 0
+            return
+        _GEMINI_BREAKER["rate_limited"] += 1
+        if _GEMINI_BREAKER["rate_limited"] >= GEMINI_BREAKER_THRESHOLD:
+            _GEMINI_BREAKER["rate_limited"] = 0
+            _GEMINI_BREAKER["open_until"] = time.time() + GEMINI_BREAKER_COOLDOWN
+            log.warning(f"Gemini circuit open for {GEMINI_BREAKER_COOLDOWN:.0f}s after repeated 429s")
+
+
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:{method}?{query}key={key}"
+
+
+def _gemini_prompt(question, sections):
+    context = _packed_context(sections, "gemini")
+
+    return f"""Use only the provided curriculum excerpts to answer the question.
 
 Question: {question}
 
@@ -140,13 +1391,20 @@ Instructions:
 
 Answer:"""
 
-    try:
-        gemini_url = (
-            "https://generativelanguage.googleapis.com/v1beta/models/"
-            f"gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-        )
-        response = requests.post(
-            gemini_url,
+
+def _gemini_request(question, sections, stream=False):
+    """POST to generateContent, or streamGenerateContent as server-sent events."""
+    url = GEMINI_URL.format(
+        method="streamGenerateContent" if stream else "generateContent",
+        query="alt=sse&" if stream else "",
+        key=GEMINI_API_KEY,
+    )
+    with _stage("prompt"):
+        prompt = _gemini_prompt(question, sections)
+    _count("prompt_chars", len(prompt))
+    with _stage("gemini"):
+        return http.post(
+            url,
             headers={"Content-Type": "application/json"},
             json={
                 "contents": [{
@@ -157,9 +1415,20 @@ Answer:"""
                     "maxOutputTokens": 500
                 }
             },
-            timeout=30
+            timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT),
+            stream=stream
         )
 
+
+def _ask_with_gemini(question, sections):
+    """Use Gemini API for answer generation"""
+    if not GEMINI_API_KEY:
+        return "[No Gemini API key configured]"
+
+    try:
+        response = _gemini_request(question, sections)
+        _gemini_record(response.status_code)
+
         if response.status_code == 200:
             data = response.json()
             if "candidates" in data and data["candidates"]:
@@ -176,55 +1445,512 @@ Answer:"""
         return None  # Signal to use Bedrock fallback
 
 
-def _ask_with_bedrock(question, sections):
-    # Check for mock mode
-    if os.environ.get("MOCK_BEDROCK") == "true":
-        # Use actual curriculum content for mock answer
-        if sections:
-            sample_text = sections[0].get('text', '')[:200]
-            return f"Based on curriculum content: {sample_text}... [Mock mode - {len(sections)} sections found]"
-        return f"Mock answer for: {question}. No curriculum sections found."
+def _stream_gemini(question, sections):
+    """Streaming twin of _ask_with_gemini: an iterator of text chunks, or None to fall back to Bedrock."""
+    if not GEMINI_API_KEY:
+        return iter(["[No Gemini API key configured]"])
+
+    try:
+        response = _gemini_request(question, sections, stream=True)
+    except Exception as e:
+        log.warning(f"Gemini error: {e}, falling back to Bedrock")
+        return None
 
+    _gemini_record(response.status_code)
+    if response.status_code == 429:
+        log.warning("Gemini rate limit hit, falling back to Bedrock")
+        return None
+    if response.status_code != 200:
+        return iter([f"[Gemini API error: {response.status_code}]"])
+
+    def chunks():
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                for candidate in data.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+    return chunks()
+
+
+def _bedrock_prompt(question, sections):
     # VERY minimal Claude Haiku invocation with sections concatenated
-    context = "\n\n---\n\n".join(
-        s.get("text") or s.get("content", "") or "" for s in sections
-    )[:12000]  # keep prompt small-ish
+    context = _packed_context(sections, "bedrock")  # keep prompt small-ish
 
-    prompt = (
+    return (
         "Use the provided excerpts only.\n\n"
         f"Question: {question}\n\n"
         f"Excerpts:\n{context}\n\n"
         "Answer:"
     )
 
+
+def _bedrock_body(question, sections):
+    with _stage("prompt"):
+        prompt = _bedrock_prompt(question, sections)
+    _count("prompt_chars", len(prompt))
+    payload = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": BEDROCK_MAX_TOKENS,
+        "temperature": 0.2,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def _mock_answer(question, sections):
+    # Use actual curriculum content for mock answer
+    if sections:
+        sample_text = sections[0].get('text', '')[:200]
+        return f"Based on curriculum content: {sample_text}... [Mock mode - {len(sections)} sections found]"
+    return f"Mock answer for: {question}. No curriculum sections found."
+
+
+def _throttled_answer(question, sections):
+    # Show actual curriculum content when throttled
+    if sections:
+        sample = sections[0].get('text', '')[:300]
+        return f"[Bedrock throttled] From curriculum: {sample}..."
+    return f"[Bedrock throttled] Question: {question} - No curriculum data available."
+
+
+def _is_throttle(e):
+    return "ThrottlingException" in str(e) or "Too many tokens" in str(e)
+
+
+def _is_retryable(e):
+    return _is_throttle(e) or "ServiceUnavailableException" in str(e) or "ModelNotReadyException" in str(e)
+
+
+class _TokenBucket:
+    """Client-side Bedrock token budget.
+
+    Refills at the configured tokens per minute and holds ten seconds' worth,
+    so peaks are spread out instead of hitting the quota. Callers reserve their
+    estimated cost up front and wait in arrival order. A throttle from Bedrock
+    halves the refill rate (the quota is shared with other containers); each
+    success gives back 5% of it.
+    """
+
+    def __init__(self, per_minute):
+        self.limit = per_minute / 60.0
+        self.rate = self.limit
+        self.capacity = max(self.limit * 10, BEDROCK_MAX_TOKENS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens, deadline):
+        """Reserve tokens, sleeping until they are available; False if that would pass deadline."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            tokens = min(tokens, self.capacity)
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if now + wait > deadline:
+                self.tokens += tokens
+                return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def settle(self, reserved, used):
+        """Give back what a call reserved but did not use (or charge the overrun)."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + reserved - used)
+
+    def throttled(self, reserved):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + reserved)
+            self.rate = max(self.limit * 0.1, self.rate * 0.5)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.limit, self.rate + self.limit * 0.05)
+
+
+_BEDROCK_BUCKET = _TokenBucket(BEDROCK_TPM) if BEDROCK_TPM > 0 else None
+
+
+class BedrockBudgetExhausted(Exception):
+    """No Bedrock capacity before the request deadline (counts as a throttle)."""
+
+    def __str__(self):
+        return "ThrottlingException: Bedrock token budget exhausted before the request deadline"
+
+
+def _deadline():
+    """Latest time.monotonic() by which Bedrock must have been called."""
+    cap = time.monotonic() + BEDROCK_MAX_WAIT_SECONDS
+    deadline = _DEADLINE.get()
+    return min(cap, deadline) if deadline is not None else cap
+
+
+def _governed(call, reserve):
+    """call() under the Bedrock token budget; throttles are retried with full-jitter
+    exponential backoff while the deadline allows. Returns (result, reserved)."""
+    deadline = _deadline()
+    attempt = 0
+    while True:
+        if _BEDROCK_BUCKET is not None:
+            with _stage("bedrock_wait"):
+                if not _BEDROCK_BUCKET.acquire(reserve, deadline):
+                    _count("bedrock_budget_exhausted")
+                    raise BedrockBudgetExhausted()
+        try:
+            with _stage("bedrock"):
+                result = call()
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            if _BEDROCK_BUCKET is not None:
+                _BEDROCK_BUCKET.throttled(reserve)
+            delay = random.uniform(0, min(BEDROCK_BACKOFF_CAP, BEDROCK_BACKOFF_BASE * 2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                raise
+            log.info(f"Bedrock {type(e).__name__}, retry {attempt + 1} in {delay:.2f}s")
+            _count("bedrock_retries")
+            with _stage("bedrock_wait"):
+                time.sleep(delay)
+            attempt += 1
+            continue
+        if _BEDROCK_BUCKET is not None:
+            _BEDROCK_BUCKET.succeeded()
+        return result, reserve
+
+
+def _bedrock_reserve(body):
+    # The JSON body is the prompt plus a little framing; the answer can use max_tokens
+    return _estimate_tokens(body.decode("utf-8")) + BEDROCK_MAX_TOKENS
+
+
+def _ask_with_bedrock(question, sections):
+    # Check for mock mode
+    if os.environ.get("MOCK_BEDROCK") == "true":
+        return _mock_answer(question, sections)
+
     try:
-        payload = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 400,
-            "temperature": 0.2,
-            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-        }
-        resp = brt.invoke_model(
+        body = _bedrock_body(question, sections)
+
+        def invoke():
+            resp = brt.invoke_model(
+                modelId=MODEL_ID,
+                contentType="application/json",
+                accept="application/json",
+                body=body,
+            )
+            return json.loads(resp["body"].read())
+        result, reserved = _governed(invoke, _bedrock_reserve(body))
+        usage = result.get("usage") or {}
+        if _BEDROCK_BUCKET is not None and usage:
+            _BEDROCK_BUCKET.settle(reserved, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+        return "".join(p.get("text", "") for p in result.get("content", []))
+    except Exception as e:
+        if _is_throttle(e):
+            return _throttled_answer(question, sections)
+        raise e
+
+
+def _stream_bedrock(question, sections):
+    """Streaming twin of _ask_with_bedrock via invoke_model_with_response_stream."""
+    if os.environ.get("MOCK_BEDROCK") == "true":
+        return iter(re.findall(r"\S+\s*", _mock_answer(question, sections)))
+
+    try:
+        body = _bedrock_body(question, sections)
+        # Usage arrives only at the end of the stream, so the reservation stands
+        resp, _ = _governed(lambda: brt.invoke_model_with_response_stream(
             modelId=MODEL_ID,
             contentType="application/json",
             accept="application/json",
-            body=json.dumps(payload).encode("utf-8"),
-        )
-        body = json.loads(resp["body"].read())
-        return "".join(p.get("text", "") for p in body.get("content", []))
+            body=body,
+        ), _bedrock_reserve(body))
     except Exception as e:
-        if "ThrottlingException" in str(e) or "Too many tokens" in str(e):
-            # Show actual curriculum content when throttled
-            if sections:
-                sample = sections[0].get('text', '')[:300]
-                return f"[Bedrock throttled] From curriculum: {sample}..."
-            return f"[Bedrock throttled] Question: {question} - No curriculum data available."
+        if _is_throttle(e):
+            return iter([_throttled_answer(question, sections)])
         raise e
 
+    def chunks():
+        for event in resp["body"]:
+            chunk = json.loads(event.get("chunk", {}).get("bytes", b"{}"))
+            if chunk.get("type") == "content_block_delta":
+                text = chunk.get("delta", {}).get("text")
+                if text:
+                    yield text
+    return chunks()
+
+
+def _is_answer(answer):
+    # "[...]" is an error or throttle placeholder (see _answer_cache_put), not an answer
+    return answer is not None and not answer.startswith("[")
+
+
+class _GeminiCall:
+    """A Gemini call running on the request's thread, raced by its Bedrock hedge.
+
+    The hedge starts Bedrock only if the call has not finished by then, and once
+    Bedrock has answered it aborts the call by shutting down the connection the
+    call is blocked on, so the request returns without waiting for Gemini.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.hedged = False
+        self.aborted = False
+        self.conn = None
+
+    def attach(self, conn):
+        """Called with the connection the call is using, again once it is connected."""
+        with self.lock:
+            self.conn = conn
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(conn)
+
+    def start_hedge(self):
+        with self.lock:
+            self.hedged = not self.done.is_set()
+            return self.hedged
+
+    def finish(self):
+        with self.lock:
+            self.done.set()
+
+    def abort(self):
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.aborted = True
+            conn = self.conn
+        if conn is not None:
+            self._shutdown(conn)
+
+    @staticmethod
+    def _shutdown(conn):
+        # Wakes the thread blocked reading the response; a connection still being
+        # opened is shut down by attach() once connect() returns
+        if conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _hedge(question, sections, call, hedge_at):
+    """Bedrock for a Gemini call that has not finished by hedge_at (time.monotonic()).
+
+    Returns None without calling Bedrock when the Gemini call finished in time.
+    """
+    if call.done.wait(max(0.0, hedge_at - time.monotonic())) or not call.start_hedge():
+        return None
+    log.info("Hedging Gemini with Bedrock")
+    answer = _ask_with_bedrock(question, sections)
+    if _is_answer(answer):
+        # A throttle placeholder does not win: Gemini may still answer
+        call.abort()
+    return answer
+
+
+def _ask_llm(question, sections):
+    """Answer with Gemini, hedged by Bedrock. Returns (answer, backend).
+
+    Bedrock runs alone when Gemini is unconfigured or its circuit is open. It
+    also starts if Gemini fails, or has not answered within GEMINI_HEDGE_SECONDS;
+    then the first usable answer wins. Gemini runs on the calling thread and only
+    the hedge goes to _HEDGE_POOL, so a busy pool can delay a hedge but never
+    the primary call, and time queued for the pool does not count as Gemini's.
+    """
+    if not GEMINI_API_KEY or not _gemini_available():
+        return _ask_with_bedrock(question, sections), "bedrock"
+    if GEMINI_HEDGE_SECONDS <= 0:
+        answer = _ask_with_gemini(question, sections)
+        # Fallback to Bedrock if Gemini rate limited
+        if answer is None:
+            return _ask_with_bedrock(question, sections), "bedrock"
+        return answer, "gemini"
+
+    call = _GeminiCall()
+    hedge = _HEDGE_POOL.submit(_carry_context(_hedge), question, sections, call,
+                               time.monotonic() + GEMINI_HEDGE_SECONDS)
+    token = _GEMINI_CALL.set(call)
+    try:
+        answer = _ask_with_gemini(question, sections)
+    finally:
+        _GEMINI_CALL.reset(token)
+        call.finish()
+    if _is_answer(answer):
+        return answer, "gemini"
+
+    # Gemini failed: Bedrock's answer, or its throttle placeholder, is all there is
+    try:
+        return (hedge.result() if call.hedged else _ask_with_bedrock(question, sections)), "bedrock"
+    except Exception as e:
+        # Neither produced an answer: report Gemini's error, else Bedrock's
+        if answer is None:
+            raise
+        log.warning(f"Bedrock call failed after a Gemini error: {e}")
+        return answer, "gemini"
+
+
+def _answer_one(question, keys, sections, cache_key):
+    """One /ask/batch result: the answer cache in front of _ask_llm."""
+    with _stage("answer_cache"):
+        cached = _answer_cache_get(cache_key)
+    if cached is not None:
+        answer, backend, sources = cached["answer"], "cache", cached["sources"]
+    else:
+        answer, backend = _ask_llm(question, sections)
+        sources = _sources(keys, sections, backend)
+        _answer_cache_put(cache_key, answer, sources)
+    _count(f"{backend}_answers")
+    return {"question": question, "answer": answer, "sources": sources, "backend": backend,
+            "cached": cached is not None}
+
+
+def _ask_batch(questions, book_ids, request_id):
+    """Answer many questions over the same books.
+
+    The books are loaded once and every question is ranked in one pass (LSA
+    scores in one matrix product), then distinct questions go to the LLM on
+    BATCH_CONCURRENCY threads. Invalid questions and LLM failures only fail
+    their own entry.
+    """
+    results = [None] * len(questions)
+    valid = []
+    for i, raw in enumerate(questions):
+        question = _validate_question(raw) if isinstance(raw, str) else None
+        if question is None:
+            results[i] = {"question": raw, "error": "Invalid or missing question"}
+        else:
+            valid.append((i, question))
+    if not valid:
+        return results
+
+    retrieved = _top_sections_batch(BUCKET, book_ids, TOP_K, [q for _, q in valid])
+    _count("sections_retrieved", sum(len(sections) for _, sections in retrieved))
+    cache_book = ",".join(sorted(book_ids))
+    # Repeats of a question (after normalization) share one LLM call
+    jobs = {}
+    for (i, question), (keys, sections) in zip(valid, retrieved):
+        cache_key = _answer_cache_key(cache_book, question, keys, sections)
+        jobs.setdefault(cache_key, (question, keys, sections, []))[3].append(i)
+
+    def answer(item):
+        cache_key, (question, keys, sections, _) = item
+        try:
+            return _answer_one(question, keys, sections, cache_key)
+        except Exception as e:
+            log.error(f"Request {request_id} batch question failed: {e}")
+            return {"question": question, "error": "Internal server error"}
+
+    asked = dict(valid)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(jobs)))) as pool:
+        for (_, (_, _, _, indices)), result in zip(jobs.items(), pool.map(_carry_context(answer), jobs.items())):
+            for i in indices:
+                results[i] = dict(result, question=asked[i])
+    return results
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _ask_events(question, book_ids, keys, sections, t_start, request_id, cache_key, cached=None):
+    """/ask as server-sent events: meta (sources), token chunks, then done."""
+    parts = []
+    try:
+        if cached is not None:
+            backend, chunks, sources = "cache", iter([cached["answer"]]), cached["sources"]
+        else:
+            use_gemini = GEMINI_API_KEY and _gemini_available()
+            backend, chunks = "gemini", (_stream_gemini(question, sections) if use_gemini else None)
+            # Fallback to Bedrock if Gemini rate limited
+            if chunks is None:
+                backend, chunks = "bedrock", _stream_bedrock(question, sections)
+            sources = _sources(keys, sections, backend)
+        yield _sse("meta", {"question": question, "book_id": book_ids[0] if len(book_ids) == 1 else None,
+                            "book_ids": book_ids, "sources": sources})
+
+        first = None
+        for text in chunks:
+            if first is None:
+                first = int((time.time() - t_start) * 1000)
+            parts.append(text)
+            yield _sse("token", {"text": text})
+    except Exception as e:
+        log.error(f"Request {request_id} stream failed: {e}")
+        yield _sse("error", {"error": "Internal server error"})
+        return
+
+    if cached is None:
+        _answer_cache_put(cache_key, "".join(parts), sources)
+    duration = int((time.time() - t_start) * 1000)
+    log.info(f"Request {request_id} streamed from {backend} in {duration}ms (first token {first}ms)")
+    done = {"backend": backend, "cached": cached is not None, "first_token_ms": first, "duration_ms": duration}
+    timings = _TIMINGS.get()
+    if timings is not None:
+        _count(f"{backend}_answers")
+        stages = timings.breakdown()
+        timings.emit("/ask", request_id, backend, stages)
+        done.update(timings=stages, counters=timings.counts())
+    yield _sse("done", done)
+
+
+def _in_context(events):
+    """Iterate events in the current context (the request's timings), wherever it is consumed."""
+    ctx = contextvars.copy_context()
+
+    def run():
+        while True:
+            try:
+                yield ctx.run(next, events)
+            except StopIteration:
+                return
+    return run()
+
+
+def _stream_ok(events):
+    """Response whose body is an iterator of SSE strings; see lambda_handler.
+
+    Server-Timing can only cover the work done before the stream starts; the
+    done event carries the full breakdown.
+    """
+    headers = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    timings = _TIMINGS.get()
+    if timings is not None:
+        headers["Server-Timing"] = _server_timing(timings.breakdown())
+    return {"statusCode": 200, "headers": headers, "body": _in_context(events)}
+
 
 def lambda_handler(event, context):
+    # The managed Python runtime cannot stream a response: a buffered event stream
+    # would only lose the hedge, so "stream": true gets the blocking JSON answer.
+    # Streaming hosts (server.py) call handle_request directly.
+    return handle_request(event, context, streaming=False)
+
+
+def _request_deadline(context):
+    """time.monotonic() by which a response must be on its way, from the Lambda context."""
+    try:
+        remaining = float(context.get_remaining_time_in_millis()) / 1000
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return time.monotonic() + remaining - DEADLINE_MARGIN_SECONDS
+
+
+def handle_request(event, context, streaming=True):
+    """Route one request. A streamed /ask returns an iterator of SSE strings as its body;
+    with streaming=False the host cannot send one, and "stream" is ignored."""
     request_id = context.aws_request_id if context else "local"
     log.info(f"Request {request_id} started")
+    token = _TIMINGS.set(_Timings())
+    deadline_token = _DEADLINE.set(_request_deadline(context))
 
     try:
         # Handle both API Gateway and Function URL formats
@@ -239,13 +1965,11 @@ def lambda_handler(event, context):
 
         # /health
         if path == "/health" and method == "GET":
-            return _ok(_health_check())
+            return _ok(*_health_check((event.get("queryStringParameters") or {}).get("mode")))
 
         # /indexes
         if path == "/indexes" and method == "GET":
-            resp = s3.list_objects_v2(Bucket=BUCKET, Prefix="indexes/", MaxKeys=100)
-            keys = [o["Key"] for o in resp.get("Contents", [])]
-            return _ok({"bucket": BUCKET, "prefix": "indexes/", "count": len(keys), "keys": keys})
+            return _indexes(event)
 
         # /ask
         if path == "/ask" and method == "POST":
@@ -253,39 +1977,109 @@ def lambda_handler(event, context):
 
             body = _parse_body(event)
             question = _validate_question(body.get("question", ""))
-            book_id = body.get("book_id", "philosophy")
 
             if not question:
                 return _ok({"error": "Invalid or missing question"}, 400)
 
-            # Build index prefix based on book_id
-            book_index_prefix = f"indexes/{book_id}/sections/"
+            # One book (book_id) or several (book_ids, or every book of a subject)
+            book_ids, error = _validate_books(body)
+            if error:
+                return _ok({"error": error}, 400)
+            book_id = book_ids[0] if len(book_ids) == 1 else None
+
+            # Load and process; several books are ranked concurrently and merged
+            keys, sections = _top_sections_federated(BUCKET, book_ids, TOP_K, question)
+            _count("sections_retrieved", len(sections))
 
-            # Load and process
-            keys, sections = _top_sections(BUCKET, book_index_prefix, TOP_K, question)
+            # Same books, question and retrieved sections -> same answer
+            cache_key = _answer_cache_key(",".join(sorted(book_ids)), question, keys, sections)
+            with _stage("answer_cache"):
+                cached = _answer_cache_get(cache_key)
 
-            # Use Gemini if API key available, otherwise Bedrock
-            if GEMINI_API_KEY:
-                answer = _ask_with_gemini(question, sections)
-                # Fallback to Bedrock if Gemini rate limited
-                if answer is None:
-                    answer = _ask_with_bedrock(question, sections)
+            if body.get("stream") and streaming:
+                return _stream_ok(_ask_events(question, book_ids, keys, sections, t_start, request_id,
+                                              cache_key, cached))
+
+            # Use Gemini if API key available (hedged by Bedrock), otherwise Bedrock
+            if cached is not None:
+                answer, backend, sources = cached["answer"], "cache", cached["sources"]
             else:
-                answer = _ask_with_bedrock(question, sections)
+                answer, backend = _ask_llm(question, sections)
+                sources = _sources(keys, sections, backend)
+                _answer_cache_put(cache_key, answer, sources)
+            _count(f"{backend}_answers")
 
             duration = int((time.time() - t_start) * 1000)
-            log.info(f"Request {request_id} completed in {duration}ms")
+            cache = _index_cache_stats()
+            log.info(f"Request {request_id} completed in {duration}ms "
+                     f"(index cache hits={cache['hits']} misses={cache['misses']} bytes={cache['bytes']})")
 
-            return _ok({
+            return _timed_ok({
                 "question": question,
                 "book_id": book_id,
+                "book_ids": book_ids,
                 "answer": answer,
-                "sources": [{"s3_key": k} for k in keys],
+                "sources": sources,
+                "backend": backend,
+                "cached": cached is not None,
+                "duration_ms": duration
+            }, _TIMINGS.get(), "/ask", request_id, backend)
+
+        # /ask/batch
+        if path == "/ask/batch" and method == "POST":
+            t_start = time.time()
+
+            body = _parse_body(event)
+            questions = body.get("questions")
+            if not isinstance(questions, list) or not questions:
+                return _ok({"error": "questions must be a non-empty list"}, 400)
+            if len(questions) > BATCH_MAX_QUESTIONS:
+                return _ok({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}, 400)
+            book_ids, error = _validate_books(body)
+            if error:
+                return _ok({"error": error}, 400)
+
+            results = _ask_batch(questions, book_ids, request_id)
+            errors = sum(1 for r in results if "error" in r)
+            duration = int((time.time() - t_start) * 1000)
+            log.info(f"Request {request_id} answered {len(results) - errors}/{len(results)} questions "
+                     f"in {duration}ms")
+
+            return _timed_ok({
+                "book_id": book_ids[0] if len(book_ids) == 1 else None,
+                "book_ids": book_ids,
+                "count": len(results),
+                "errors": errors,
+                "results": results,
                 "duration_ms": duration
-            })
+            }, _TIMINGS.get(), "/ask/batch", request_id)
 
-        return _ok({"message": "Use /health, /indexes or /ask"}, 404)
+        return _ok({"message": "Use /health, /indexes, /ask or /ask/batch"}, 404)
 
     except Exception as e:
         log.error(f"Request {request_id} failed: {e}")
         return _ok({"error": "Internal server error"}, 500)
+    finally:
+        _TIMINGS.reset(token)
+        _DEADLINE.reset(deadline_token)
+
+
+def _prewarm():
+    """Init-phase warmup: the INDEX_PREFIX book into the index cache, plus the
+    client of the backend that will answer. Failures only cost the warmup."""
+    t0 = time.perf_counter()
+    try:
+        _book_index(BUCKET, INDEX_PREFIX)
+        if GEMINI_API_KEY:
+            http._get()
+        brt._get()
+    except Exception as e:
+        log.warning(f"Prewarm of {INDEX_PREFIX} failed: {e}")
+    _COLD_START["prewarm_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+if PREWARM_INDEX:
+    _prewarm()
+_COLD_START["init_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+log.info(f"Init done in {_COLD_START['init_ms']}ms (imports {_COLD_START['import_ms']}ms, "
+         f"prewarm {_COLD_START.get('prewarm_ms', 'off')})")
@@ -0,0 +1,215 @@
+"""Long-running HTTP server around handler.handle_request, for running the API
+image outside Lambda (on-prem deployments).
+
+One process keeps one warm index cache, answer cache and set of pooled clients
+for every request it serves; requests run on a fixed thread pool, and once
+every thread is busy and the queue is full new requests get 503 instead of
+piling up. --processes forks that many such workers over one listening socket
+(index.bin is mmap'd from INDEX_DIR, so the page cache is still shared).
+
+    python server.py --port 8080 --threads 32
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+log = logging.getLogger()
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8080"))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "32"))
+# Accepted connections allowed to wait for a thread before new ones get 503
+SERVER_QUEUE = int(os.environ.get("SERVER_QUEUE", "64"))
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", "1"))
+# Per-request deadline handed to the handler (as Lambda's remaining time would be)
+SERVER_REQUEST_TIMEOUT = float(os.environ.get("SERVER_REQUEST_TIMEOUT", "60"))
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", str(1024 * 1024)))
+# An idle keep-alive connection holds a thread; close it after this long
+SERVER_KEEPALIVE_SECONDS = float(os.environ.get("SERVER_KEEPALIVE_SECONDS", "5"))
+
+
+class RequestContext:
+    """The parts of the Lambda context object handler.py reads."""
+
+    def __init__(self, timeout):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "EduBot"
+    timeout = SERVER_KEEPALIVE_SECONDS
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        import handler
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._send(413, {"Content-Type": "application/json"}, json.dumps({"error": "Request body too large"}))
+            self.close_connection = True
+            return
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        url = urlsplit(self.path)
+        event = {
+            "httpMethod": self.command,
+            "path": url.path,
+            "queryStringParameters": dict(parse_qsl(url.query)) or None,
+            "headers": dict(self.headers.items()),
+            "body": body,
+            "isBase64Encoded": False,
+        }
+        resp = handler.handle_request(event, RequestContext(self.server.request_timeout))
+        self._send(resp["statusCode"], resp.get("headers") or {}, resp["body"])
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if isinstance(body, str):
+            data = body.encode("utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # A streamed /ask: one chunk per server-sent event, flushed as it is produced
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in body:
+                data = event.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            log.info("Client went away mid-stream")
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        log.info(f"{self.address_string()} {format % args}")
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands connections to a fixed thread pool and sheds load
+    with 503 once threads + queue slots are all taken."""
+
+    def __init__(self, address, threads=SERVER_THREADS, queue=SERVER_QUEUE,
+                 request_timeout=SERVER_REQUEST_TIMEOUT, sock=None):
+        super().__init__(address, ApiRequestHandler, bind_and_activate=sock is None)
+        if sock is not None:
+            # Pre-forked worker: serve the parent's listening socket
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.request_timeout = request_timeout
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api")
+        self.slots = threading.BoundedSemaphore(threads + queue)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        self.pool.submit(self._work, request, client_address)
+
+    def _work(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def _reject(self, request):
+        body = b'{"error": "Server busy, retry shortly"}'
+        try:
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                            b"Retry-After: 1\r\nConnection: close\r\n"
+                            b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def _serve(server):
+    """serve_forever until SIGTERM/SIGINT, then finish in-flight requests."""
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    log.info(f"Serving on {server.server_address[0]}:{server.server_address[1]} (pid {os.getpid()})")
+    server.serve_forever()
+    server.server_close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    ap = argparse.ArgumentParser(description="Serve the EduBot API over HTTP outside Lambda")
+    ap.add_argument("--host", default=SERVER_HOST)
+    ap.add_argument("--port", type=int, default=SERVER_PORT)
+    ap.add_argument("--threads", type=int, default=SERVER_THREADS, help="Request threads per process")
+    ap.add_argument("--queue", type=int, default=SERVER_QUEUE, help="Connections that may wait for a thread")
+    ap.add_argument("--processes", type=int, default=SERVER_PROCESSES,
+                    help="Pre-forked worker processes, each with its own warm caches")
+    ap.add_argument("--request-timeout", type=float, default=SERVER_REQUEST_TIMEOUT)
+    args = ap.parse_args()
+    # handler sizes its hedge pool from this, so every request thread can have a hedge waiting
+    os.environ["SERVER_THREADS"] = str(args.threads)
+
+    def worker(sock=None):
+        # handler is imported per process, after any fork: clients and caches are never shared across processes
+        import handler  # noqa: F401
+        _serve(PooledHTTPServer((args.host, args.port), args.threads, args.queue, args.request_timeout, sock))
+
+    if args.processes <= 1:
+        worker()
+        return
+
+    sock = socket.create_server((args.host, args.port), backlog=args.threads + args.queue)
+    children = []
+    for _ in range(args.processes):
+        pid = os.fork()
+        if pid == 0:
+            worker(sock)
+            os._exit(0)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
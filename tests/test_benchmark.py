@@ -0,0 +1,30 @@
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+import benchmark
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_percentiles(self):
+        stats = benchmark.percentiles([float(i) for i in range(1, 101)])
+        self.assertEqual((stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]), (50.0, 95.0, 99.0))
+        self.assertEqual(benchmark.percentiles([3.0, 1.0])["p50_ms"], 1.0)
+
+    def test_small_run(self):
+        run = benchmark.bench_ask(books=2, sections=30, requests=20, concurrency=4,
+                                  llm_latency_ms=1, s3_latency_ms=0, seed=1)
+        self.assertEqual(run["requests"], 20)
+        self.assertGreater(run["throughput_rps"], 0)
+        self.assertLessEqual(run["warm"]["p50_ms"], run["warm"]["p99_ms"])
+        # warm requests are served from the index cache
+        self.assertLess(run["s3_calls_per_request"], 1)
+
+        indexed = benchmark.bench_indexer(pages=12, pages_per_block=3, seed=1)
+        self.assertEqual(indexed["pages"], 12)
+        self.assertGreater(indexed["sections"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
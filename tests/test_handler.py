@@ -12,7 +12,14 @@ os.environ['CURRICULUM_BUCKET'] = 'test-bucket'
 
 import handler
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import indexer  # noqa: E402
+
 class TestLambdaHandler(unittest.TestCase):
+
+    def setUp(self):
+        handler._ANSWER_CACHE.clear()
+        handler._GEMINI_BREAKER.update(rate_limited=0, open_until=0.0)
     
     def test_health_endpoint(self):
         event = {"httpMethod": "GET", "path": "/health"}
@@ -24,6 +31,57 @@ class TestLambdaHandler(unittest.TestCase):
         self.assertEqual(result['statusCode'], 200)
         body = json.loads(result['body'])
         self.assertTrue(body['ok'])
+
+    def test_health_modes_share_cached_probes(self):
+        handler._HEALTH.update(checked_at=0.0, checks=None, refreshing=False)
+        self.addCleanup(handler._HEALTH.update, checked_at=0.0, checks=None, refreshing=False)
+
+        def health(mode=None):
+            event = {"httpMethod": "GET", "path": "/health",
+                     "queryStringParameters": {"mode": mode} if mode else None}
+            result = handler.lambda_handler(event, None)
+            return result["statusCode"], json.loads(result["body"])
+
+        with patch.object(handler, "s3") as s3, patch.object(handler, "bedrock") as bedrock:
+            code, body = health("live")
+            self.assertEqual((code, body["mode"]), (200, "live"))
+            self.assertNotIn("checks", body)
+            s3.head_bucket.assert_not_called()
+
+            # the first default check probes, later ones within the TTL reuse it
+            code, body = health()
+            self.assertEqual((code, body["dependencies"]), (200, "healthy"))
+            self.assertIn("latency_ms", body["checks"]["s3"])
+            health()
+            health("ready")
+            self.assertEqual(s3.head_bucket.call_count, 1)
+
+            bedrock.list_foundation_models.side_effect = RuntimeError("throttled")
+            with patch.object(handler, "HEALTH_READY_MIN_SECONDS", 0):
+                code, body = health("ready")
+            self.assertEqual((code, body["ok"], body["dependencies"]), (503, False, "partial"))
+            self.assertEqual(body["checks"]["bedrock"]["error"], "RuntimeError")
+            self.assertEqual(s3.head_bucket.call_count, 2)
+
+            # error details stay in the log: /health is unauthenticated
+            arn = "arn:aws:sts::123456789012:assumed-role/edubot-lambda/fn"
+            s3.head_bucket.side_effect = handler.ClientError(
+                {"Error": {"Code": "AccessDenied", "Message": f"User: {arn} is not authorized"}}, "HeadBucket")
+            with patch.object(handler, "HEALTH_READY_MIN_SECONDS", 0), self.assertLogs(level="WARNING") as logs:
+                code, body = health("ready")
+            self.assertEqual(body["checks"]["s3"], {"ok": False, "latency_ms": body["checks"]["s3"]["latency_ms"],
+                                                    "error": "AccessDenied"})
+            self.assertNotIn("123456789012", json.dumps(body))
+            self.assertIn(arn, "\n".join(logs.output))
+            s3.head_bucket.side_effect = None
+
+            # stale results are served while one background probe refreshes them
+            bedrock.list_foundation_models.side_effect = None
+            with patch.object(handler, "HEALTH_PROBE_TTL", 0), patch.object(handler.threading, "Thread") as thread:
+                code, body = health()
+                health()
+            self.assertEqual((code, body["dependencies"]), (200, "partial"))
+            thread.assert_called_once_with(target=handler._probe_dependencies, daemon=True)
     
     def test_validate_question(self):
         # Valid question
@@ -55,5 +113,838 @@ class TestLambdaHandler(unittest.TestCase):
         result = handler._parse_body(event)
         self.assertEqual(result["raw"], "invalid json")
 
+    def test_load_shard(self):
+        shard = {
+            "book_id": "philosophy",
+            "subject": "philosophy",
+            "sections": [
+                {"section_id": "philosophy-b0-s0", "title": "t0", "page_start": 1, "page_end": 3,
+                 "offset": 0, "length": 5},
+                {"section_id": "philosophy-b1-s0", "title": "t1", "page_start": 4, "page_end": 6,
+                 "offset": 5, "length": 5},
+            ],
+            "text": "helloworld",
+        }
+        body = MagicMock()
+        body.read.return_value = json.dumps(shard).encode("utf-8")
+        with patch.object(handler, "s3") as s3:
+            s3.get_object.return_value = {"Body": body}
+            sections = handler._load_shard("test-bucket", "indexes/philosophy/sections/")
+
+        s3.get_object.assert_called_once_with(Bucket="test-bucket", Key="indexes/philosophy/shard.json")
+        self.assertEqual(len(sections), 2)
+        key, section = sections[1]
+        self.assertEqual(key, "indexes/philosophy/sections/philosophy-b1-s0.json")
+        self.assertEqual(section["text"], "world")
+        self.assertEqual(section["book_id"], "philosophy")
+
+    def test_bm25_rank_matches_whole_tokens(self):
+        sections = [
+            ("k0", {"section_id": "s0", "text": "We start with the basics of logic."}),
+            ("k1", {"section_id": "s1", "text": "Greek art and the philosophy of art."}),
+            ("k2", {"section_id": "s2", "text": "Philosophy asks questions about knowledge."}),
+        ]
+        index = handler._build_bm25(sections)
+
+        ranked = handler._bm25_rank(index, "What is art?", 3)
+        self.assertEqual([doc for doc, _ in ranked], [1])
+
+        ranked = handler._bm25_rank(index, "art philosophy", 3)
+        self.assertEqual(ranked[0][0], 1)
+        self.assertEqual(len(ranked), 2)
+
+    def test_load_section_objects_paginates(self):
+        pages = [
+            {"Contents": [{"Key": f"indexes/b/sections/s{i}.json"} for i in range(1000)]},
+            {"Contents": [{"Key": f"indexes/b/sections/s{i}.json"} for i in range(1000, 1500)]},
+        ]
+
+        def get_object(Bucket, Key):
+            if Key.endswith("s7.json"):
+                raise Exception("boom")
+            body = MagicMock()
+            body.read.return_value = json.dumps({"section_id": Key, "text": "x"}).encode("utf-8")
+            return {"Body": body}
+
+        with patch.object(handler, "s3") as s3:
+            s3.get_paginator.return_value.paginate.return_value = pages
+            s3.get_object.side_effect = get_object
+            sections = handler._load_section_objects("test-bucket", "indexes/b/sections/")
+
+        self.assertEqual(len(sections), 1499)
+        self.assertEqual(sections[0][0], "indexes/b/sections/s0.json")
+        self.assertEqual(sections[-1][0], "indexes/b/sections/s1499.json")
+        self.assertTrue(all(key == section["section_id"] for key, section in sections))
+
+    def test_book_index_cache(self):
+        handler._INDEX_CACHE.clear()
+        book = {"sections": [("k0", {"section_id": "s0", "text": "x" * 100})],
+                "bm25": {"postings": {}}, "positions": [0]}
+        with patch.object(handler, "s3") as s3, \
+                patch.object(handler, "_load_book", return_value=book) as load, \
+                patch.object(handler, "INDEX_REVALIDATE_SECONDS", 0):
+            s3.head_object.return_value = {"ETag": '"v1"'}
+            handler._book_index("test-bucket", "indexes/b/sections/")
+            handler._book_index("test-bucket", "indexes/b/sections/")
+            self.assertEqual(load.call_count, 1)
+
+            # a re-index changes toc.json's ETag and invalidates the entry
+            s3.head_object.return_value = {"ETag": '"v2"'}
+            handler._book_index("test-bucket", "indexes/b/sections/")
+            self.assertEqual(load.call_count, 2)
+
+        with patch.object(handler, "s3") as s3, patch.object(handler, "_load_book") as load:
+            # inside the revalidation window warm requests touch S3 not at all
+            handler._book_index("test-bucket", "indexes/b/sections/")
+            s3.head_object.assert_not_called()
+            load.assert_not_called()
+
+        with patch.object(handler, "s3"), \
+                patch.object(handler, "_load_book", return_value=book), \
+                patch.object(handler, "INDEX_CACHE_BYTES", 1):
+            handler._book_index("test-bucket", "indexes/other/sections/")
+        self.assertEqual(list(handler._INDEX_CACHE), [("test-bucket", "indexes/other/")])
+        stats = handler._index_cache_stats()
+        self.assertGreaterEqual(stats["evictions"], 1)
+        handler._INDEX_CACHE.clear()
+
+    def test_book_index_loads_once_under_concurrency(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        handler._INDEX_CACHE.clear()
+        self.addCleanup(handler._INDEX_CACHE.clear)
+        book = {"sections": [("k0", {"section_id": "s0", "text": "x"})], "bm25": {"postings": {}}, "positions": [0]}
+        start = threading.Barrier(16)
+
+        def get(_):
+            start.wait()
+            return handler._book_index("test-bucket", "indexes/b/sections/")
+
+        def slow_load(bucket, prefix):
+            time.sleep(0.2)
+            return book
+
+        with patch.object(handler, "s3") as s3, \
+                patch.object(handler, "_load_book", side_effect=slow_load) as load, \
+                ThreadPoolExecutor(max_workers=16) as pool:
+            s3.head_object.return_value = {"ETag": '"v1"'}
+            books = list(pool.map(get, range(16)))
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(s3.head_object.call_count, 1)
+        self.assertTrue(all(b is book for b in books))
+        self.assertFalse(handler._INDEX_LOADS)
+
+        # a failed load fails every waiter, and the next request tries again
+        handler._INDEX_CACHE.clear()
+        start.reset()
+
+        def failing_load(bucket, prefix):
+            time.sleep(0.2)
+            raise RuntimeError("S3 down")
+
+        with patch.object(handler, "s3"), \
+                patch.object(handler, "_load_book", side_effect=failing_load) as load, \
+                ThreadPoolExecutor(max_workers=16) as pool:
+            futures = [pool.submit(get, i) for i in range(16)]
+            errors = [f.exception() for f in futures]
+        self.assertEqual(load.call_count, 1)
+        self.assertTrue(all(isinstance(e, RuntimeError) for e in errors))
+        with patch.object(handler, "s3"), patch.object(handler, "_load_book", return_value=book):
+            self.assertIs(handler._book_index("test-bucket", "indexes/b/sections/"), book)
+
+    def test_lazy_clients_and_prewarm(self):
+        created = []
+        lazy = handler._Lazy("fake", lambda: created.append(1) or MagicMock(ping=lambda: "pong"))
+        self.assertEqual(created, [])
+        self.assertEqual(lazy.ping(), "pong")
+        self.assertEqual(lazy.ping(), "pong")
+        self.assertEqual(created, [1])
+        self.assertIn("fake", handler._COLD_START["lazy_ms"])
+
+        handler._INDEX_CACHE.clear()
+        book = {"sections": [("k0", {"section_id": "s0", "text": "x"})], "bm25": {"postings": {}}, "positions": [0]}
+        with patch.object(handler, "s3") as s3, patch.object(handler, "brt") as brt, \
+                patch.object(handler, "_load_book", return_value=book) as load:
+            s3.head_object.return_value = {"ETag": '"v1"'}
+            handler._prewarm()
+            brt._get.assert_called_once()
+            handler._book_index("test-bucket", handler.INDEX_PREFIX)
+            self.assertEqual(load.call_count, 1)
+        self.assertIn("prewarm_ms", handler._COLD_START)
+        self.assertIn("init_ms", handler._cold_start_stats())
+        handler._INDEX_CACHE.clear()
+
+    def test_cold_start_goes_to_the_first_emitted_record(self):
+        import contextlib
+        import io
+        cold = {"import_ms": 90.0, "init_ms": 700.0}
+        with patch.object(handler, "_COLD_START", cold), patch.object(handler, "s3"), \
+                patch.object(handler, "bedrock"):
+            # /health emits no EMF record, so it must leave the cold start for the next route that does
+            handler.lambda_handler({"httpMethod": "GET", "path": "/health"}, None)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                handler._Timings().emit("/ask", "r1")
+                handler._Timings().emit("/ask", "r2")
+        first, second = (json.loads(line) for line in out.getvalue().splitlines())
+        self.assertEqual((first["ColdStart"], first["init_ms"]), (True, 700.0))
+        self.assertNotIn("ColdStart", second)
+
+    def test_load_binary_mmap(self):
+        import pathlib
+        import shutil
+        import tempfile
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        sections = [
+            {"section_id": "b-b0-s0", "title": "t0", "page_start": 1, "page_end": 2, "text": "Épistémologie"},
+            {"section_id": "b-b1-s0", "title": "t1", "page_start": 3, "page_end": 4, "text": "Kant on duty"},
+        ]
+        src = pathlib.Path(tmp, "src.bin")
+        indexer.write_binary_index(src, {"book_id": "b", "subject": "s", "sections": []}, sections)
+
+        cache = os.path.join(tmp, "cache")
+        with patch.object(handler, "s3") as s3, patch.object(handler, "INDEX_DIR", cache):
+            s3.download_file.side_effect = lambda bucket, key, dest: shutil.copy(src, dest)
+            s3.head_object.return_value = {"ETag": '"v1"'}
+            loaded, blob, spans = handler._load_binary("test-bucket", "indexes/b/sections/")
+            # the copy in INDEX_DIR is reused while its ETag matches, and replaced when it doesn't
+            handler._load_binary("test-bucket", "indexes/b/sections/")[1].close()
+            self.assertEqual(s3.download_file.call_count, 1)
+            s3.head_object.return_value = {"ETag": '"v2"'}
+            handler._load_binary("test-bucket", "indexes/b/sections/")[1].close()
+            self.assertEqual(s3.download_file.call_count, 2)
+
+        book = {"sections": loaded, "blob": blob, "spans": spans}
+        self.assertNotIn("text", loaded[0][1])
+        key, section = handler._book_section(book, 0)
+        self.assertEqual(key, "indexes/b/sections/b-b0-s0.json")
+        self.assertEqual(section["text"], "Épistémologie")
+        self.assertEqual(handler._book_section(book, 1)[1]["text"], "Kant on duty")
+        self.assertEqual(section["page_end"], 2)
+
+        # evicting the book removes its file; the live mapping is unaffected
+        path = os.path.join(cache, "indexes_b.bin")
+        self.assertEqual(sorted(os.listdir(cache)), ["indexes_b.bin", "indexes_b.bin.etag"])
+        other = {"sections": [], "bm25": {"postings": {}}}
+        self.addCleanup(handler._INDEX_CACHE.clear)
+        handler._INDEX_CACHE.clear()
+        with patch.object(handler, "INDEX_DIR", cache), patch.object(handler, "INDEX_CACHE_BYTES", 0), \
+                patch.object(handler, "_toc_version", return_value='"t"'), \
+                patch.object(handler, "_load_book", side_effect=[dict(book, bm25={"postings": {}}), other]):
+            handler._book_index("test-bucket", "indexes/b/sections/")
+            self.assertTrue(os.path.exists(path))
+            handler._book_index("test-bucket", "indexes/c/sections/")
+        self.assertEqual(os.listdir(cache), [])
+        self.assertEqual(handler._book_section(book, 1)[1]["text"], "Kant on duty")
+        blob.close()
+
+    @unittest.skipIf(handler.np is None, "numpy not installed")
+    def test_lsa_matches_paraphrases(self):
+        import io
+        import pathlib
+        import shutil
+        import tempfile
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        texts = [
+            "kant duty categorical imperative moral law",
+            "kant reason duty moral law autonomy",
+            "categorical imperative universal moral law maxim",
+            "plato cave forms justice soul",
+            "plato republic justice guardians soul",
+            "aristotle virtue mean habit ethics",
+        ]
+        sections = [(f"k{i}", {"section_id": f"s{i}", "text": text}) for i, text in enumerate(texts)]
+        lsa = indexer.lsa_vectors(indexer.build_bm25_index([s for _, s in sections]), dims=3)
+        indexer.write_lsa(pathlib.Path(tmp, "lsa.bin"), lsa)
+        data = pathlib.Path(tmp, "lsa.bin").read_bytes()
+
+        with patch.object(handler, "s3") as s3:
+            s3.get_object.return_value = {"Body": io.BytesIO(data)}
+            loaded = handler._load_lsa("test-bucket", "indexes/b/sections/")
+        loaded["positions"] = handler.np.arange(len(sections))
+        book = {"sections": sections, "bm25": handler._build_bm25(sections),
+                "positions": list(range(len(sections))), "lsa": loaded}
+
+        def rank(book, question):
+            return [pos for pos, _ in handler._rank_sections(book, question, 3)]
+
+        # s2 never mentions kant; keywords alone cannot find it
+        self.assertNotIn(2, rank(dict(book, lsa=None), "what did kant think"))
+        with patch.object(handler, "RETRIEVAL_MODE", "lsa"):
+            self.assertEqual(sorted(rank(book, "what did kant think")), [0, 1, 2])
+        ranked = rank(book, "what did kant think")
+        self.assertEqual(sorted(ranked[:2]), [0, 1])
+        self.assertEqual(ranked[2], 2)
+        # outside the LSA vocabulary falls back to BM25
+        self.assertEqual(rank(book, "aristotle habit"), [5])
+
+    def test_stream_gemini_parses_sse(self):
+        response = MagicMock()
+        response.status_code = 200
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = [
+            'data: {"candidates": [{"content": {"parts": [{"text": "Kant "}]}}]}',
+            '',
+            'data: {"candidates": [{"content": {"parts": [{"text": "said so."}]}}]}',
+        ]
+        with patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler.http, "post", return_value=response) as post:
+            chunks = list(handler._stream_gemini("What is duty?", [{"text": "duty"}]))
+        self.assertEqual(chunks, ["Kant ", "said so."])
+        self.assertIn(":streamGenerateContent?alt=sse&key=k", post.call_args[0][0])
+
+        response.status_code = 429
+        with patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler.http, "post", return_value=response):
+            self.assertIsNone(handler._stream_gemini("What is duty?", []))
+
+    def test_stream_bedrock_chunks(self):
+        events = [
+            {"chunk": {"bytes": json.dumps({"type": "message_start"}).encode()}},
+            {"chunk": {"bytes": json.dumps({"type": "content_block_delta", "delta": {"text": "Hi"}}).encode()}},
+            {"chunk": {"bytes": json.dumps({"type": "content_block_delta", "delta": {"text": "!"}}).encode()}},
+        ]
+        with patch.object(handler, "brt") as brt, patch.dict(os.environ, {"MOCK_BEDROCK": "false"}):
+            brt.invoke_model_with_response_stream.return_value = {"body": events}
+            self.assertEqual("".join(handler._stream_bedrock("q?", [])), "Hi!")
+
+    def test_bedrock_governor_retries_within_deadline(self):
+        import io
+        throttle = Exception("An error occurred (ThrottlingException) when calling the InvokeModel operation")
+        ok = {"body": io.BytesIO(json.dumps({"content": [{"text": "Duty."}],
+                                             "usage": {"input_tokens": 50, "output_tokens": 10}}).encode())}
+        bucket = handler._TokenBucket(6000)  # 100 tokens/s, 1000 burst
+        sleeps = []
+        with patch.object(handler, "brt") as brt, patch.object(handler, "_BEDROCK_BUCKET", bucket), \
+                patch.object(handler.time, "sleep", side_effect=sleeps.append), \
+                patch.dict(os.environ, {"MOCK_BEDROCK": "false"}):
+            brt.invoke_model.side_effect = [throttle, throttle, ok]
+            self.assertEqual(handler._ask_with_bedrock("What is duty?", [{"text": "Duty."}]), "Duty.")
+            self.assertEqual(brt.invoke_model.call_count, 3)
+            # jittered exponential backoff, and the rate halves on each throttle
+            self.assertEqual(len(sleeps), 2)
+            self.assertTrue(0 <= sleeps[0] <= handler.BEDROCK_BACKOFF_BASE)
+            self.assertTrue(0 <= sleeps[1] <= 2 * handler.BEDROCK_BACKOFF_BASE)
+            self.assertLess(bucket.rate, bucket.limit)
+            # the reservation was settled to the 60 tokens actually used
+            self.assertGreater(bucket.tokens, bucket.capacity - 100)
+
+            # no time left for another try: degrade to the excerpt answer
+            brt.invoke_model.side_effect = throttle
+            token = handler._DEADLINE.set(handler.time.monotonic() + 0.001)
+            try:
+                answer = handler._ask_with_bedrock("What is duty?", [{"text": "Duty."}])
+            finally:
+                handler._DEADLINE.reset(token)
+            self.assertTrue(answer.startswith("[Bedrock throttled]"))
+
+            # a drained bucket refuses work it could only start after the deadline
+            now = handler.time.monotonic()
+            self.assertTrue(bucket.acquire(bucket.capacity, now + 60))
+            self.assertFalse(bucket.acquire(500, now + 1))
+        self.assertIsNone(handler._request_deadline(None))
+
+    def test_ask_stream_only_where_the_host_streams(self):
+        event = {"httpMethod": "POST", "path": "/ask",
+                 "body": json.dumps({"question": "What is duty?", "stream": True})}
+        with patch.object(handler, "_top_sections", return_value=(["k0"], [{"text": "Duty is duty."}])), \
+                patch.object(handler, "GEMINI_API_KEY", None), \
+                patch.dict(os.environ, {"MOCK_BEDROCK": "true"}):
+            result = handler.lambda_handler(event, None)
+            handler._ANSWER_CACHE.clear()
+            streamed = handler.handle_request(event, None)
+            body = "".join(streamed["body"])
+
+        # Lambda cannot stream, so it answers on the blocking (hedged) path
+        self.assertEqual(result["headers"]["Content-Type"], "application/json")
+        self.assertEqual(json.loads(result["body"])["answer"],
+                         handler._mock_answer("What is duty?", [{"text": "Duty is duty."}]))
+
+        self.assertEqual(streamed["headers"]["Content-Type"], "text/event-stream")
+        events = [block.split("\n") for block in body.strip().split("\n\n")]
+        self.assertEqual(events[0][0], "event: meta")
+        self.assertEqual(events[-1][0], "event: done")
+        tokens = "".join(json.loads(e[1][len("data: "):])["text"] for e in events if e[0] == "event: token")
+        self.assertEqual(tokens, handler._mock_answer("What is duty?", [{"text": "Duty is duty."}]))
+
+    def test_ask_reports_stage_timings(self):
+        import io
+        from contextlib import redirect_stdout
+        brt = MagicMock()
+        brt.invoke_model.return_value = {"body": io.BytesIO(json.dumps({"content": [{"text": "Duty."}]}).encode())}
+        event = {"httpMethod": "POST", "path": "/ask", "body": json.dumps({"question": "What is duty?"})}
+        out = io.StringIO()
+        with patch.object(handler, "_top_sections", return_value=(["k0"], [{"text": "Duty is duty."}])), \
+                patch.object(handler, "GEMINI_API_KEY", None), patch.object(handler, "brt", brt), \
+                redirect_stdout(out):
+            result = handler.lambda_handler(event, None)
+
+        body = json.loads(result["body"])
+        self.assertEqual(list(body["timings"]), ["answer_cache", "prompt", "bedrock", "total"])
+        self.assertEqual(body["counters"]["sections_retrieved"], 1)
+        self.assertGreater(body["counters"]["prompt_chars"], len("Duty is duty."))
+        self.assertRegex(result["headers"]["Server-Timing"], r"^answer_cache;dur=[\d.]+, .*total;dur=[\d.]+$")
+
+        emf = json.loads(out.getvalue())
+        metrics = emf["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(metrics["Dimensions"], [["Route"], ["Route", "Backend"]])
+        self.assertIn({"Name": "bedrock_ms", "Unit": "Milliseconds"}, metrics["Metrics"])
+        self.assertEqual((emf["Route"], emf["Backend"], emf["bedrock_answers"]), ("/ask", "bedrock", 1))
+        # nothing leaks into work done outside a request
+        self.assertIsNone(handler._TIMINGS.get())
+
+        event["body"] = json.dumps({"question": "What is duty?", "stream": True})
+        with patch.object(handler, "_top_sections", return_value=(["k0"], [{"text": "Duty is duty."}])), \
+                patch.object(handler, "GEMINI_API_KEY", None), \
+                patch.dict(os.environ, {"MOCK_BEDROCK": "true"}), redirect_stdout(io.StringIO()):
+            handler._ANSWER_CACHE.clear()
+            result = handler.handle_request(event, None)
+            body = "".join(result["body"])
+        done = json.loads(body.strip().split("\n\n")[-1].split("\n")[1][len("data: "):])
+        self.assertIn("total", done["timings"])
+        self.assertEqual(done["counters"]["bedrock_answers"], 1)
+
+    def test_answer_cache(self):
+        import shutil
+        import tempfile
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        sections = (["indexes/b/sections/b-b0-s0.json"], [{"text": "Duty is duty."}])
+
+        def ask(question):
+            event = {"httpMethod": "POST", "path": "/ask",
+                     "body": json.dumps({"question": question, "book_id": "b"})}
+            return json.loads(handler.lambda_handler(event, None)["body"])
+
+        with patch.object(handler, "_top_sections", return_value=sections), \
+                patch.object(handler, "GEMINI_API_KEY", None), \
+                patch.object(handler, "ANSWER_CACHE_DIR", tmp), \
+                patch.object(handler, "_ask_with_bedrock", return_value="Duty.") as llm:
+            self.assertFalse(ask("What is duty?")["cached"])
+            hit = ask("  what is DUTY ")
+            self.assertTrue(hit["cached"])
+            self.assertEqual(hit["answer"], "Duty.")
+            self.assertEqual(llm.call_count, 1)
+
+            # a cold container still hits the shared tier
+            handler._ANSWER_CACHE.clear()
+            self.assertTrue(ask("What is duty?")["cached"])
+
+            with patch.object(handler, "ANSWER_CACHE_TTL", 0):
+                handler._ANSWER_CACHE.clear()
+                self.assertFalse(ask("What is duty?")["cached"])
+            self.assertEqual(llm.call_count, 2)
+
+        a, c = {"text": "alpha"}, {"text": "gamma"}
+        self.assertNotEqual(handler._answer_cache_key("b", "q", ["a.json"], [a]),
+                            handler._answer_cache_key("b", "q", ["a.json", "c.json"], [a, c]))
+        # same section ID with revised text is a different key
+        self.assertNotEqual(handler._answer_cache_key("b", "q", ["a.json"], [a]),
+                            handler._answer_cache_key("b", "q", ["a.json"], [{"text": "alpha, revised"}]))
+
+    def _gemini_server(self, delay):
+        """A local Gemini endpoint answering "from gemini" after delay seconds."""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        release = threading.Event()
+
+        class Gemini(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                release.wait(delay)
+                body = json.dumps({"candidates": [{"content": {"parts": [{"text": "from gemini"}]}}]}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # the hedge won and the client hung up
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 32  # room for every concurrent ask's connect
+
+        server = Server(("127.0.0.1", 0), Gemini)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(release.set)
+        return f"http://127.0.0.1:{server.server_port}/{{method}}?{{query}}key={{key}}"
+
+    def test_ask_llm_hedges_slow_gemini(self):
+        import time
+
+        # Bedrock answers first, and the Gemini request still in flight is abandoned
+        with patch.object(handler, "GEMINI_URL", self._gemini_server(5)), \
+                patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 0.05), \
+                patch.object(handler, "http", handler._Lazy("http", handler._http_session)), \
+                patch.object(handler, "_ask_with_bedrock", return_value="from bedrock") as bedrock:
+            started = time.time()
+            self.assertEqual(handler._ask_llm("q?", []), ("from bedrock", "bedrock"))
+            self.assertLess(time.time() - started, 0.4)
+            bedrock.assert_called_once()
+
+        with patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 1), \
+                patch.object(handler, "_ask_with_gemini", return_value="from gemini"), \
+                patch.object(handler, "_ask_with_bedrock") as bedrock:
+            self.assertEqual(handler._ask_llm("q?", []), ("from gemini", "gemini"))
+            bedrock.assert_not_called()
+
+    def test_ask_llm_throttled_hedge_does_not_beat_gemini(self):
+        throttled = handler._throttled_answer("q?", [{"text": "Duty is duty."}])
+        self.assertFalse(handler._is_answer(throttled))
+
+        # Gemini slow but fine, Bedrock throttled: the placeholder does not abort Gemini
+        with patch.object(handler, "GEMINI_URL", self._gemini_server(0.5)), \
+                patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 0.05), \
+                patch.object(handler, "http", handler._Lazy("http", handler._http_session)), \
+                patch.object(handler, "_ask_with_bedrock", return_value=throttled) as bedrock:
+            self.assertEqual(handler._ask_llm("q?", []), ("from gemini", "gemini"))
+            bedrock.assert_called_once()
+
+        # both fail: the Bedrock placeholder is what the caller gets
+        with patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 1), \
+                patch.object(handler, "_ask_with_gemini", return_value=None), \
+                patch.object(handler, "_ask_with_bedrock", return_value=throttled):
+            self.assertEqual(handler._ask_llm("q?", []), (throttled, "bedrock"))
+
+    def test_ask_llm_hedges_more_asks_than_hedge_workers(self):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        def ask():
+            started = time.time()
+            return handler._ask_llm("q?", []), time.time() - started
+
+        def run(asks):
+            with ThreadPoolExecutor(max_workers=asks) as callers:
+                return list(callers.map(lambda _: ask(), range(asks)))
+
+        hedges = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(hedges.shutdown)
+
+        # Gemini answering inside the hedge delay is never held up by busy hedge workers
+        with patch.object(handler, "_HEDGE_POOL", hedges), \
+                patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 0.5), \
+                patch.object(handler, "_ask_with_gemini", side_effect=lambda q, s: time.sleep(0.2) or "from gemini"), \
+                patch.object(handler, "_ask_with_bedrock") as bedrock:
+            results = run(8)
+        self.assertEqual({answer for answer, _ in results}, {("from gemini", "gemini")})
+        self.assertLess(max(took for _, took in results), 0.45)
+        bedrock.assert_not_called()
+
+        # Slow Gemini: every ask is hedged on time and returns with Bedrock's answer
+        with patch.object(handler, "_HEDGE_POOL", hedges), \
+                patch.object(handler, "GEMINI_URL", self._gemini_server(5)), \
+                patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_HEDGE_SECONDS", 0.1), \
+                patch.object(handler, "http", handler._Lazy("http", handler._http_session)), \
+                patch.object(handler, "_ask_with_bedrock", return_value="from bedrock"):
+            results = run(8)
+        self.assertEqual({answer for answer, _ in results}, {("from bedrock", "bedrock")})
+        self.assertLess(max(took for _, took in results), 1)
+
+    def test_gemini_session_reuses_connections(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        connections = []
+
+        class Gemini(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                connections.append(self.client_address)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                body = json.dumps({"candidates": [{"content": {"parts": [{"text": "Duty."}]}}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Gemini)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/{{method}}?{{query}}key={{key}}"
+
+        with patch.object(handler, "GEMINI_URL", url), patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "http", handler._Lazy("http", handler._http_session)):
+            answers = [handler._ask_with_gemini("What is duty?", [{"text": "Duty."}]) for _ in range(3)]
+        self.assertEqual(answers, ["Duty."] * 3)
+        self.assertEqual(len(connections), 1)
+
+    def test_gemini_circuit_breaker(self):
+        response = MagicMock(status_code=429)
+        with patch.object(handler, "GEMINI_API_KEY", "k"), \
+                patch.object(handler, "GEMINI_BREAKER_THRESHOLD", 3), \
+                patch.object(handler.http, "post", return_value=response) as post, \
+                patch.object(handler, "_ask_with_bedrock", return_value="from bedrock"):
+            for _ in range(3):
+                self.assertEqual(handler._ask_llm("q?", []), ("from bedrock", "bedrock"))
+            self.assertEqual(post.call_count, 3)
+            self.assertFalse(handler._gemini_available())
+
+            # while open, Gemini is not even tried
+            self.assertEqual(handler._ask_llm("q?", []), ("from bedrock", "bedrock"))
+            self.assertEqual(post.call_count, 3)
+
+    def test_federated_retrieval_merges_books(self):
+        import time as _time
+        books = {
+            "vol1": [(f"indexes/vol1/sections/v1s{i}.json", {"section_id": f"v1s{i}", "text": text})
+                     for i, text in enumerate(["roman empire trade", "roman roads", "bronze age"])],
+            "vol2": [(f"indexes/vol2/sections/v2s{i}.json", {"section_id": f"v2s{i}", "text": text})
+                     for i, text in enumerate(["ottoman empire trade routes trade", "industrial revolution"])],
+        }
+
+        def book_index(bucket, prefix):
+            _time.sleep(0.2)
+            sections = books[prefix.split("/")[1]]
+            return {"sections": sections, "bm25": handler._build_bm25(sections),
+                    "positions": list(range(len(sections))), "lsa": None}
+
+        with patch.object(handler, "_book_index", side_effect=book_index):
+            t0 = _time.time()
+            keys, sections = handler._top_sections_federated("test-bucket", ["vol1", "vol2"], 3, "empire trade")
+            self.assertLess(_time.time() - t0, 0.35)  # concurrent, not 2 x 0.2s
+        # scores are comparable across books: vol2's hit has "trade" twice
+        self.assertEqual([s["section_id"] for s in sections], ["v2s0", "v1s0"])
+        self.assertEqual(keys[0], "indexes/vol2/sections/v2s0.json")
+
+        rows = [{"book_id": b, "subject": sub} for b, sub in
+                [("philosophy", "philosophy"), ("vol1", "History"), ("vol2", "history")]]
+        with patch.object(handler, "_CATALOG", {"checked_at": _time.time(), "entries": {}, "books": rows,
+                                                "etag": '"x"'}):
+            self.assertEqual(handler._validate_books({"subject": "History"}), (["vol1", "vol2"], None))
+        self.assertEqual(handler._validate_books({"book_ids": ["a", "a", "b"]}), (["a", "b"], None))
+        self.assertEqual(handler._validate_books({})[0], ["philosophy"])
+        self.assertIsNotNone(handler._validate_books({"book_ids": ["../x"]})[1])
+        self.assertIsNotNone(handler._validate_books({"book_ids": [f"b{i}" for i in range(20)]})[1])
+
+    def test_indexes_catalog(self):
+        import io
+        from botocore.exceptions import ClientError
+        tocs = {f"b{i}": {"subject": "history" if i % 2 else "math", "created_at": 100 + i, "sections": [
+            {"section_id": f"b{i}-s{j}", "page_start": 2 * j + 1, "page_end": 2 * j + 2, "bytes": 10}
+            for j in range(i + 1)]} for i in range(5)}
+
+        def get_object(Bucket, Key, IfNoneMatch=None):
+            book_id = Key.split("/")[1]
+            if IfNoneMatch == f'"{book_id}"':
+                raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+            return {"Body": io.BytesIO(json.dumps(tocs[book_id]).encode()), "ETag": f'"{book_id}"'}
+
+        def indexes(headers=None, **params):
+            event = {"httpMethod": "GET", "path": "/indexes", "headers": headers or {},
+                     "queryStringParameters": {k: str(v) for k, v in params.items()} or None}
+            return handler.lambda_handler(event, None)
+
+        self.addCleanup(handler._CATALOG.update, checked_at=0.0, entries={}, books=[], etag=None)
+        handler._CATALOG.update(checked_at=0.0, entries={}, books=[], etag=None)
+        with patch.object(handler, "s3") as s3:
+            s3.get_paginator.return_value.paginate.return_value = [
+                {"CommonPrefixes": [{"Prefix": f"indexes/b{i}/"} for i in (3, 1, 0)]},
+                {"CommonPrefixes": [{"Prefix": f"indexes/b{i}/"} for i in (4, 2)]}]
+            s3.get_object.side_effect = get_object
+
+            resp = indexes(limit=2)
+            body = json.loads(resp["body"])
+            self.assertEqual([b["book_id"] for b in body["books"]], ["b0", "b1"])
+            self.assertEqual((body["total"], body["next_cursor"]), (5, "b1"))
+            self.assertEqual(body["books"][1], {"book_id": "b1", "subject": "history", "source_pdf": None,
+                                                "sections": 2, "page_start": 1, "page_end": 4,
+                                                "created_at": 101, "bytes": 20})
+            body = json.loads(indexes(limit=2, cursor="b3")["body"])
+            self.assertEqual(([b["book_id"] for b in body["books"]], body["next_cursor"]), (["b4"], None))
+            body = json.loads(indexes(subject="History")["body"])
+            self.assertEqual([b["book_id"] for b in body["books"]], ["b1", "b3"])
+
+            # within the TTL the catalog costs no S3 calls; a matching ETag costs no body
+            self.assertEqual(s3.get_object.call_count, 5)
+            again = indexes({"If-None-Match": resp["headers"]["ETag"]}, limit=2)
+            self.assertEqual((again["statusCode"], again["body"]), (304, ""))
+
+            # after the TTL unchanged toc.json files come back as 304s and the ETag holds
+            with patch.object(handler, "CATALOG_TTL_SECONDS", 0):
+                again = indexes({"if-none-match": resp["headers"]["ETag"]}, limit=2)
+            self.assertEqual(again["statusCode"], 304)
+            self.assertEqual(s3.get_object.call_count, 10)
+            self.assertEqual(indexes(limit="x")["statusCode"], 400)
+
+    def test_federated_retrieval_ranks_an_irrelevant_book_below(self):
+        filler = ["bronze age tools", "river valleys", "early farming", "pottery styles"]
+        books = {
+            # shares one word with the question and nothing else
+            "vol1": [(f"indexes/vol1/sections/v1s{i}.json", {"section_id": f"v1s{i}", "text": text})
+                     for i, text in enumerate(["duty of river pilots"] + filler)],
+            "vol2": [(f"indexes/vol2/sections/v2s{i}.json", {"section_id": f"v2s{i}", "text": text})
+                     for i, text in enumerate(["kant grounds duty in the categorical imperative",
+                                               "the categorical imperative as kant states it"] + filler)],
+        }
+
+        def book_index(bucket, prefix):
+            sections = books[prefix.split("/")[1]]
+            return {"sections": sections, "bm25": handler._build_bm25(sections),
+                    "positions": list(range(len(sections))), "lsa": None}
+
+        with patch.object(handler, "_book_index", side_effect=book_index):
+            per_book = [handler._ranked_sections("test-bucket", f"indexes/{b}/sections/", 3,
+                                                 ["kant categorical imperative duty"])[0] for b in books]
+            _, sections = handler._top_sections_federated("test-bucket", ["vol1", "vol2"], 2,
+                                                          "kant categorical imperative duty")
+        self.assertLess(per_book[0][0][0], 0.3)
+        self.assertGreater(per_book[1][0][0], 0.7)
+        self.assertEqual([s["section_id"] for s in sections], ["v2s0", "v2s1"])
+
+    def test_catalog_keeps_books_through_transient_errors(self):
+        import io
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from botocore.exceptions import ClientError
+        state = {"missing": set(), "slow": set()}
+        listed = threading.Event()
+
+        def get_object(Bucket, Key, IfNoneMatch=None):
+            book_id = Key.split("/")[1]
+            if book_id in state["slow"]:
+                raise ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+            if book_id in state["missing"]:
+                raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+            return {"Body": io.BytesIO(json.dumps({"subject": "history"}).encode()), "ETag": f'"{book_id}"'}
+
+        def paginate(**kwargs):
+            listed.wait(2)
+            return [{"CommonPrefixes": [{"Prefix": f"indexes/{b}/"} for b in ("vol1", "vol2")]}]
+
+        self.addCleanup(handler._CATALOG.update, checked_at=0.0, entries={}, books=[], etag=None)
+        handler._CATALOG.update(checked_at=0.0, entries={}, books=[], etag=None)
+        with patch.object(handler, "s3") as s3, patch.object(handler, "CATALOG_TTL_SECONDS", 0):
+            s3.get_paginator.return_value.paginate.side_effect = paginate
+            s3.get_object.side_effect = get_object
+
+            # concurrent requests after the TTL share one rebuild
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                futures = [pool.submit(handler._catalog, "bucket") for _ in range(4)]
+                time.sleep(0.1)
+                listed.set()
+                results = [f.result() for f in futures]
+            self.assertEqual(s3.get_paginator.return_value.paginate.call_count, 1)
+            self.assertEqual({len(books) for books, _ in results}, {2})
+
+            # a throttled GET keeps the previous row; only a missing toc.json drops the book
+            state["slow"].add("vol2")
+            self.assertEqual([b["book_id"] for b in handler._catalog("bucket")[0]], ["vol1", "vol2"])
+            state["slow"].clear()
+            state["missing"].add("vol2")
+            self.assertEqual([b["book_id"] for b in handler._catalog("bucket")[0]], ["vol1"])
+
+    def test_ask_batch(self):
+        sections = [(f"indexes/b/sections/s{i}.json", {"section_id": f"s{i}", "text": text})
+                    for i, text in enumerate(["duty and the categorical imperative", "plato and the cave"])]
+        book = {"sections": sections, "bm25": handler._build_bm25(sections), "positions": [0, 1], "lsa": None}
+
+        def bedrock(question, sections):
+            if "fail" in question:
+                raise RuntimeError("boom")
+            return f"answer to {question}"
+
+        event = {"httpMethod": "POST", "path": "/ask/batch", "body": json.dumps({
+            "book_id": "b", "questions": ["What is duty?", "what is DUTY", "", "Tell me about the cave", "fail me"]})}
+        with patch.object(handler, "_book_index", return_value=book) as book_index, \
+                patch.object(handler, "GEMINI_API_KEY", None), \
+                patch.object(handler, "_ask_with_bedrock", side_effect=bedrock) as llm:
+            result = handler.lambda_handler(event, None)
+
+        self.assertEqual(result["statusCode"], 200)
+        body = json.loads(result["body"])
+        self.assertEqual((body["count"], body["errors"]), (5, 2))
+        results = body["results"]
+        self.assertEqual(results[0]["answer"], "answer to What is duty?")
+        self.assertEqual(results[0]["sources"][0]["s3_key"], "indexes/b/sections/s0.json")
+        # the repeat shares the first call; the bad entries fail alone
+        self.assertEqual((results[1]["question"], results[1]["answer"]), ("what is DUTY", results[0]["answer"]))
+        self.assertIn("error", results[2])
+        self.assertEqual(results[3]["sources"][0]["s3_key"], "indexes/b/sections/s1.json")
+        self.assertEqual(results[4], {"question": "fail me", "error": "Internal server error"})
+        self.assertEqual(book_index.call_count, 1)
+        self.assertEqual(llm.call_count, 3)
+
+        too_many = {"httpMethod": "POST", "path": "/ask/batch",
+                    "body": json.dumps({"questions": ["q?"] * (handler.BATCH_MAX_QUESTIONS + 1)})}
+        self.assertEqual(handler.lambda_handler(too_many, None)["statusCode"], 400)
+
+    def test_snippets_keep_only_matching_sentences(self):
+        filler = [f"Filler sentence number {i} talks about weather." for i in range(12)]
+        sentences = filler[:5] + ["Kant grounds duty in the categorical imperative."] + filler[5:]
+        text = " ".join(sentences)
+        section = {"section_id": "s0", "text": text}
+        idf = {"kant": 3.0, "duty": 2.0, "weather": 0.1}
+
+        snippet = handler._snippet(section, "What is Kant's view of duty?", idf)
+        self.assertIn("categorical imperative", snippet["text"])
+        self.assertLess(len(snippet["text"]), len(text) / 2)
+        for start, end in snippet["spans"]:
+            self.assertIn(text[start:end].strip(), snippet["text"])
+        # offsets recorded by the indexer give the same cut as splitting on the fly
+        stored = handler._snippet(dict(section, sentences=indexer.sentence_starts(text)), "Kant and duty", idf)
+        self.assertEqual(stored["spans"], handler._snippet(section, "Kant and duty", idf)["spans"])
+
+        # no term hit (an LSA-only match) or a short section: sent whole
+        self.assertIs(handler._snippet(section, "What is beauty?", idf), section)
+        short = {"section_id": "s1", "text": "Kant wrote on duty. He died in 1804."}
+        self.assertIs(handler._snippet(short, "Kant duty", idf), short)
+
+        # the same budget now holds far more distinct sections, each with its spans in sources
+        many = [dict(section, section_id=f"s{i}", text=text.replace("number", f"n{i}")) for i in range(20)]
+        snippets = [handler._snippet(sec, "Kant duty", idf) for sec in many]
+        with patch.object(handler, "BEDROCK_CONTEXT_TOKENS", 1000):
+            self.assertGreater(len(handler._pack_context(snippets, 1000)), 2 * len(handler._pack_context(many, 1000)))
+            sources = handler._sources([f"indexes/b/sections/s{i}.json" for i in range(20)], snippets, "bedrock")
+        self.assertEqual(sources[0]["spans"], snippets[0]["spans"])
+
+    def test_pack_context(self):
+        sections = [
+            {"section_id": "s0", "text": "a" * 400},   # 100 tokens
+            {"section_id": "s1", "text": "b" * 2000},  # too big for what is left
+            {"section_id": "s2", "text": "a" * 400},   # duplicate text of s0
+            {"section_id": "s3", "text": "c" * 200},
+            {"section_id": "s0", "text": "d" * 40},    # duplicate id
+        ]
+        picked = handler._pack_context(sections, 200)
+        self.assertEqual(picked, [0, 3])
+        self.assertEqual(handler._pack_context(sections, 10), [])
+
+        keys = [f"indexes/b/sections/k{i}.json" for i in range(len(sections))]
+        with patch.object(handler, "BEDROCK_CONTEXT_TOKENS", 200):
+            self.assertEqual(handler._sources(keys, sections, "bedrock"),
+                             [{"s3_key": keys[0], "book_id": "b"}, {"s3_key": keys[3], "book_id": "b"}])
+            prompt = handler._bedrock_prompt("q?", sections)
+        self.assertIn("a" * 400, prompt)
+        self.assertNotIn("b", prompt.split("Excerpts:")[1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
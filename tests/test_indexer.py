@@ -1,10 +1,35 @@
+import json
+import threading
 import unittest
 import sys
 import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
 
-from indexer import normalize_ws, split_paragraphs, chunk_paragraphs
+import indexer
+from indexer import normalize_ws, split_paragraphs, chunk_paragraphs, build_shard, \
+    build_bm25_index, tokenize, extract_pdf_to_chunks, page_ranges
+
+class LocalS3:
+    """Just enough of the S3 client for the uploader."""
+    def __init__(self):
+        self.objects, self.puts, self.lock = {}, 0, threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise KeyError(Key)
+            return {"ETag": '"kms-etag"', "Metadata": self.objects[Key]["Metadata"]}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self.lock:
+            self.puts += 1
+            self.objects[Key] = dict(kwargs, Body=Body.read())
+
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
 
 class TestIndexer(unittest.TestCase):
     
@@ -30,5 +55,224 @@ class TestIndexer(unittest.TestCase):
         chunked_text = " ".join(chunks)
         self.assertGreater(len(chunked_text), 0)
 
+    def test_build_shard(self):
+        toc = {"book_id": "b", "subject": "s", "created_at": 1, "sections": []}
+        sections = [
+            {"section_id": "b-b0-s0", "title": "t0", "page_start": 1, "page_end": 1, "text": "alpha"},
+            {"section_id": "b-b0-s1", "title": "t1", "page_start": 1, "page_end": 1, "text": "beta"},
+        ]
+        shard = build_shard(toc, sections)
+        self.assertEqual(shard["book_id"], "b")
+        self.assertEqual(shard["sections"][0]["sentences"], [])
+        text = "First one. Second (two)! \u201cThird?\u201d Fourth, e.g. not a fifth."
+        starts = indexer.sentence_starts(text)
+        self.assertEqual([text[a:b] for a, b in zip([0] + starts, starts + [len(text)])],
+                         ["First one. ", "Second (two)! ", "\u201cThird?\u201d ", "Fourth, e.g. not a fifth."])
+        for entry, sec in zip(shard["sections"], sections):
+            start = entry["offset"]
+            self.assertEqual(shard["text"][start:start + entry["length"]], sec["text"])
+
+    def test_streaming_writers_match_in_memory_builders(self):
+        import shutil
+        import tempfile
+        import pathlib
+        import indexer
+
+        tmp = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        toc = {"book_id": "b", "subject": "s", "created_at": 1}
+        sections = [
+            {"section_id": f"b-b{i}-s0", "title": f"t{i}", "page_start": i + 1, "page_end": i + 1,
+             "text": f"Chapter {i}: \"quoted\" caf\u00e9 \\ tab\there \u2014 end"}
+            for i in range(5)
+        ]
+        shard = indexer.ShardWriter(tmp / "shard.json", toc)
+        for sec in sections:
+            shard.add(sec)
+        shard.close()
+        expected = json.dumps(build_shard(toc, sections), ensure_ascii=False, separators=(",", ":"))
+        self.assertEqual((tmp / "shard.json").read_text(encoding="utf-8"), expected)
+
+        indexer.write_binary_index(tmp / "index.bin", toc, sections)
+        texts = indexer.PreviousTexts(tmp / "index.bin")
+        self.addCleanup(texts.close)
+        self.assertEqual(texts["b-b3-s0"], sections[3]["text"])
+        self.assertIsNone(texts.get("missing"))
+
+    def test_build_bm25_index(self):
+        self.assertEqual(tokenize("The Start of ART, 1984!"), ["start", "art", "1984"])
+        sections = [
+            {"section_id": "b-b0-s0", "text": "duty and the categorical imperative"},
+            {"section_id": "b-b0-s1", "text": "duty duty virtue"},
+        ]
+        index = build_bm25_index(sections)
+        self.assertEqual(index["doc_ids"], ["b-b0-s0", "b-b0-s1"])
+        self.assertEqual(index["doc_len"], [3, 3])
+        self.assertEqual(index["postings"]["duty"], [[0, 1], [1, 2]])
+        # rarer terms carry more weight
+        self.assertGreater(index["idf"]["virtue"], index["idf"]["duty"])
+
+    def test_page_ranges_are_block_aligned(self):
+        ranges = page_ranges(10, 3, 2)
+        self.assertEqual(ranges, [(0, 6), (6, 10)])
+        for parts in range(1, 8):
+            ranges = page_ranges(100, 3, parts)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], 100)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(start % 3, 0)
+        # long books get more ranges rather than bigger ones
+        ranges = page_ranges(1000, 2, 4, max_blocks=16)
+        self.assertEqual(len(ranges), 32)
+        self.assertTrue(all(end - start <= 32 for start, end in ranges))
+
+    def test_parallel_extraction_matches_serial(self):
+        import types
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest.mock import MagicMock, patch
+
+        pages = []
+        for i in range(23):
+            page = MagicMock()
+            page.extract_text.return_value = "" if i in (3, 4, 5) else f"Page {i} text. " * (i % 5 + 1)
+            pages.append(page)
+        pdf = MagicMock(pages=pages)
+        pdf.__enter__.return_value = pdf
+        fake_pdfplumber = types.SimpleNamespace(open=lambda path: pdf)
+
+        with patch.dict(sys.modules, {"pdfplumber": fake_pdfplumber}), \
+                patch("concurrent.futures.ProcessPoolExecutor", ThreadPoolExecutor):
+            serial = extract_pdf_to_chunks("book.pdf", pages_per_block=3)
+            parallel = extract_pdf_to_chunks("book.pdf", pages_per_block=3, workers=3)
+
+        self.assertEqual(parallel, serial)
+        # the empty block (pages 4-6) is skipped without leaving a gap in block_index
+        self.assertEqual([c["block_index"] for c in serial], list(range(len(serial))))
+        self.assertEqual(serial[1]["page_start"], 7)
+        self.assertEqual(serial[-1]["page_end"], 23)
+
+    def test_incremental_reindex(self):
+        import shutil
+        import tempfile
+        import types
+        from unittest.mock import MagicMock, patch
+        import indexer
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+
+        def fake_pdf(texts):
+            pages = []
+            for text in texts:
+                stream = MagicMock(spec=["get_data"])
+                stream.get_data.return_value = text.encode("utf-8")
+                page = MagicMock()
+                page.page_obj.mediabox = [0, 0, 612, 792]
+                page.page_obj.contents = [stream]
+                page.extract_text.return_value = text
+                pages.append(page)
+            pdf = MagicMock(pages=pages)
+            pdf.__enter__.return_value = pdf
+            return types.SimpleNamespace(open=lambda path: pdf), pages
+
+        def run(texts):
+            pdfplumber, pages = fake_pdf(texts)
+            argv = ["indexer.py", "--pdf", "book.pdf", "--book-id", "b", "--subject", "s",
+                    "--outdir", tmp, "--pages-per-block", "2", "--incremental"]
+            with patch.dict(sys.modules, {"pdfplumber": pdfplumber}), patch.object(sys, "argv", argv):
+                indexer.main()
+            return pages
+
+        # no previous manifest: one pass extracts and fingerprints, with no separate hashing pass
+        with patch.object(indexer, "fingerprint_blocks") as prepass:
+            run([f"Page {i}." for i in range(6)])
+        prepass.assert_not_called()
+        sections_dir = os.path.join(tmp, "b", "sections")
+        self.assertEqual(sorted(os.listdir(sections_dir)), ["b-b0-s0.json", "b-b1-s0.json", "b-b2-s0.json"])
+        os.utime(os.path.join(sections_dir, "b-b0-s0.json"), (0, 0))
+
+        # errata on page 3 only
+        pages = run(["Page 0.", "Page 1.", "Page 2 (corrected).", "Page 3.", "Page 4.", "Page 5."])
+        extracted = [i for i, page in enumerate(pages) if page.extract_text.called]
+        self.assertEqual(extracted, [2, 3])
+        self.assertEqual(os.path.getmtime(os.path.join(sections_dir, "b-b0-s0.json")), 0)
+        with open(os.path.join(sections_dir, "b-b1-s0.json"), encoding="utf-8") as f:
+            self.assertIn("corrected", json.load(f)["text"])
+        with open(os.path.join(tmp, "b", "shard.json"), encoding="utf-8") as f:
+            shard = json.load(f)
+        self.assertEqual([e["section_id"] for e in shard["sections"]], ["b-b0-s0", "b-b1-s0", "b-b2-s0"])
+        self.assertIn("Page 5.", shard["text"])
+
+        # the last block is dropped from the edition
+        run(["Page 0.", "Page 1.", "Page 2 (corrected).", "Page 3."])
+        self.assertEqual(sorted(os.listdir(sections_dir)), ["b-b0-s0.json", "b-b1-s0.json"])
+
+    def test_upload_dir_to_s3_is_concurrent_and_idempotent(self):
+        import shutil
+        import tempfile
+        import pathlib
+        import indexer
+
+        tmp = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        for i in range(50):
+            indexer.write_json(tmp / "sections" / f"s{i}.json", {"i": i})
+        indexer.write_json(tmp / "toc.json", {"n": 50})
+
+        s3 = LocalS3()
+        summary = indexer.upload_dir_to_s3(tmp, "bucket", "indexes/b/", "alias/k", workers=8, s3=s3)
+        self.assertEqual((summary["uploaded"], summary["skipped"]), (51, 0))
+        obj = s3.objects["indexes/b/sections/s7.json"]
+        self.assertEqual(json.loads(obj["Body"]), {"i": 7})
+        self.assertEqual((obj["ServerSideEncryption"], obj["SSEKMSKeyId"]), ("aws:kms", "alias/k"))
+
+        indexer.write_json(tmp / "toc.json", {"n": 49})
+        summary = indexer.upload_dir_to_s3(tmp, "bucket", "indexes/b", "alias/k", workers=8, s3=s3,
+                                           delete=["sections/s49.json"])
+        self.assertEqual((summary["uploaded"], summary["skipped"], summary["deleted"]), (1, 50, 1))
+        self.assertEqual(s3.puts, 52)
+        self.assertNotIn("indexes/b/sections/s49.json", s3.objects)
+
+    def test_unchanged_rerun_skips_uploads(self):
+        import shutil
+        import tempfile
+        import types
+        from unittest.mock import MagicMock, patch
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        texts = [f"Page {i} is about duty and virtue." for i in range(6)]
+
+        def run(now):
+            pages = []
+            for text in texts:
+                stream = MagicMock(spec=["get_data"])
+                stream.get_data.return_value = text.encode("utf-8")
+                page = MagicMock()
+                page.page_obj.mediabox = [0, 0, 612, 792]
+                page.page_obj.contents = [stream]
+                page.extract_text.return_value = text
+                pages.append(page)
+            pdf = MagicMock(pages=pages)
+            pdf.__enter__.return_value = pdf
+            argv = ["indexer.py", "--pdf", "book.pdf", "--book-id", "b", "--subject", "s", "--outdir", tmp,
+                    "--pages-per-block", "2", "--s3-bucket", "bucket", "--upload-workers", "4"]
+            with patch.dict(sys.modules, {"pdfplumber": types.SimpleNamespace(open=lambda path: pdf)}), \
+                    patch.object(sys, "argv", argv), patch.object(indexer, "make_s3_client", return_value=s3), \
+                    patch.object(indexer.time, "time", return_value=now):
+                indexer.main()
+
+        s3 = LocalS3()
+        run(1000)
+        first = s3.puts
+        self.assertIn("indexes/b/sections/b-b0-s0.json", s3.objects)
+
+        # a full (not --incremental) re-run of the same PDF an hour later re-uploads only toc.json
+        run(4600)
+        self.assertEqual(s3.puts, first + 1)
+        self.assertEqual(json.loads(s3.objects["indexes/b/toc.json"]["Body"])["created_at"], 4600)
+        self.assertNotIn("created_at", json.loads(s3.objects["indexes/b/sections/b-b0-s0.json"]["Body"]))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import http.client
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'api'))
+os.environ['CURRICULUM_BUCKET'] = 'test-bucket'
+
+import handler
+import server
+
+class TestServer(unittest.TestCase):
+
+    def start(self, **kwargs):
+        httpd = server.PooledHTTPServer(("127.0.0.1", 0), **kwargs)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return httpd.server_address[1]
+
+    def setUp(self):
+        handler._ANSWER_CACHE.clear()
+        patches = [
+            patch.object(handler, "_top_sections", return_value=(["k0"], [{"text": "Duty is duty."}])),
+            patch.object(handler, "GEMINI_API_KEY", None),
+            patch.dict(os.environ, {"MOCK_BEDROCK": "true"}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_ask_over_keep_alive_connection(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.start(threads=4, queue=4))
+        self.addCleanup(conn.close)
+
+        conn.request("GET", "/health?mode=live")
+        resp = conn.getresponse()
+        self.assertEqual((resp.status, json.loads(resp.read())["mode"]), (200, "live"))
+
+        conn.request("POST", "/ask", body=json.dumps({"question": "What is duty?"}))
+        resp = conn.getresponse()
+        body = json.loads(resp.read())
+        self.assertEqual(resp.status, 200)
+        self.assertIn("Duty is duty.", body["answer"])
+        self.assertIn("total;dur=", resp.getheader("Server-Timing"))
+
+        conn.request("POST", "/ask", body=json.dumps({"question": "What is duty?", "stream": True}))
+        resp = conn.getresponse()
+        self.assertEqual(resp.getheader("Transfer-Encoding"), "chunked")
+        events = resp.read().decode().strip().split("\n\n")
+        self.assertTrue(events[0].startswith("event: meta"))
+        self.assertTrue(events[-1].startswith("event: done"))
+
+    def test_sheds_load_when_full(self):
+        release = threading.Event()
+        entered = threading.Event()
+
+        def slow(question, sections):
+            entered.set()
+            release.wait(5)
+            return "Slow."
+
+        port = self.start(threads=1, queue=0)
+        with patch.object(handler, "_ask_with_bedrock", side_effect=slow):
+            busy = http.client.HTTPConnection("127.0.0.1", port)
+            self.addCleanup(busy.close)
+            busy.request("POST", "/ask", body=json.dumps({"question": "What is duty?"}))
+            self.assertTrue(entered.wait(5))
+
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            self.addCleanup(conn.close)
+            conn.request("GET", "/health?mode=live")
+            resp = conn.getresponse()
+            self.assertEqual((resp.status, resp.getheader("Retry-After")), (503, "1"))
+
+            release.set()
+            self.assertEqual(busy.getresponse().status, 200)
+
+if __name__ == '__main__':
+    unittest.main()
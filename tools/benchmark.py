@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+import argparse, contextlib, io, json, math, os, pathlib, platform, random, shutil, subprocess, sys, tempfile, threading, time, types
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from unittest.mock import patch
+
+#Purpose: offline benchmarks for /ask and the indexer, no AWS or LLM needed
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "tools"))
+sys.path.insert(0, str(ROOT / "src" / "api"))
+os.environ.setdefault("CURRICULUM_BUCKET", "bench-bucket")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION"])
+
+import indexer  # noqa: E402
+
+RESULTS_FORMAT = "edubot-bench/1"
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "an", "el", "is", "or", "um", "ber", "con", "dra"]
+
+# --- synthetic corpus ---
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def make_text(vocab: List[str], words: int, rng: random.Random) -> str:
+    # Zipf-ish: low ranks are common, like real prose
+    picked = [vocab[min(int(rng.paretovariate(1.1)) - 1, len(vocab) - 1)] for _ in range(words)]
+    sentences = [" ".join(picked[i:i + 12]).capitalize() + "." for i in range(0, len(picked), 12)]
+    return "\n\n".join(" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5))
+
+def make_book(book_id: str, sections: int, vocab: List[str], rng: random.Random,
+              words: int = 250) -> List[Dict[str, Any]]:
+    objs = []
+    for i in range(sections):
+        objs.append({
+            "book_id": book_id,
+            "subject": "bench",
+            "section_id": f"{book_id}-b{i}-s0",
+            "title": f"{book_id} block {i} chunk 0",
+            "page_start": 3 * i + 1,
+            "page_end": 3 * i + 3,
+            "text": make_text(vocab, words, rng)
+        })
+    return objs
+
+def make_question(vocab: List[str], rng: random.Random) -> str:
+    terms = [vocab[min(int(rng.paretovariate(0.8)) - 1, len(vocab) - 1)] for _ in range(rng.randint(2, 5))]
+    return "What is the relation between " + " and ".join(terms) + "?"
+
+# --- local S3 stand-in ---
+class LocalS3:
+    """In-memory S3 with just the calls handler.py makes, plus optional per-call latency."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.objects: Dict[str, bytes] = {}
+        self.latency = latency_ms / 1000.0
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name: str) -> None:
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _missing(self, op: str, key: str):
+        from botocore.exceptions import ClientError
+        return ClientError({"Error": {"Code": "NoSuchKey", "Message": key}}, op)
+
+    def put(self, key: str, data: bytes) -> None:
+        self.objects[key] = data
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("get_object")
+        if Key not in self.objects:
+            raise self._missing("GetObject", Key)
+        return {"Body": io.BytesIO(self.objects[Key]), "ContentLength": len(self.objects[Key])}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("head_object")
+        if Key not in self.objects:
+            raise self._missing("HeadObject", Key)
+        return {"ETag": f'"{hash(self.objects[Key]) & 0xffffffff:08x}"', "ContentLength": len(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call("put_object")
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.encode("utf-8") if isinstance(Body, str) \
+            else Body.read()
+        return {}
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        self._call("download_file")
+        if Key not in self.objects:
+            raise self._missing("HeadObject", Key)
+        with open(Filename, "wb") as f:
+            f.write(self.objects[Key])
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._call("list_objects_v2")
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        if Delimiter:
+            prefixes = sorted({Prefix + k[len(Prefix):].split(Delimiter, 1)[0] + Delimiter
+                               for k in keys if Delimiter in k[len(Prefix):]})
+            return {"CommonPrefixes": [{"Prefix": p} for p in prefixes],
+                    "Contents": [{"Key": k} for k in keys if Delimiter not in k[len(Prefix):]]}
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        resp = {"Contents": [{"Key": k, "Size": len(self.objects[k])} for k in page], "KeyCount": len(page)}
+        if start + MaxKeys < len(keys):
+            resp.update(IsTruncated=True, NextContinuationToken=str(start + MaxKeys))
+        return resp
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                token = None
+                while True:
+                    page = s3.list_objects_v2(**kwargs, ContinuationToken=token)
+                    yield page
+                    token = page.get("NextContinuationToken")
+                    if not token:
+                        return
+        return Paginator()
+
+def publish_book(s3: LocalS3, book_id: str, section_objs: List[Dict[str, Any]], workdir: pathlib.Path) -> None:
+    """Write a book's index artifacts the way the indexer does and put them in s3."""
+    base = workdir / book_id
+    base.mkdir(parents=True, exist_ok=True)
+    toc = {"book_id": book_id, "subject": "bench", "source_pdf": f"{book_id}.pdf", "created_at": 0}
+    shard = indexer.ShardWriter(base / "shard.json", toc)
+    binary = indexer.BinaryIndexWriter(base / "index.bin", toc)
+    bm25 = indexer.Bm25Builder()
+    for sec in section_objs:
+        shard.add(sec)
+        binary.add(sec)
+        bm25.add(sec["section_id"], sec["text"])
+    shard.close()
+    binary.close()
+    index = bm25.build()
+    entries = [{k: sec[k] for k in ("section_id", "title", "page_start", "page_end")} for sec in section_objs]
+    prefix = f"indexes/{book_id}/"
+    s3.put(prefix + "toc.json", json.dumps(dict(toc, sections=entries)).encode("utf-8"))
+    s3.put(prefix + "shard.json", (base / "shard.json").read_bytes())
+    s3.put(prefix + "index.bin", (base / "index.bin").read_bytes())
+    s3.put(prefix + "bm25.json", json.dumps(index, separators=(",", ":")).encode("utf-8"))
+    lsa = indexer.lsa_vectors(index)
+    if lsa is not None:
+        indexer.write_lsa(base / "lsa.bin", lsa)
+        s3.put(prefix + "lsa.bin", (base / "lsa.bin").read_bytes())
+
+# --- measurements ---
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+    def rank(p: float) -> float:  # nearest-rank
+        return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 3)
+    return {"p50_ms": rank(50), "p95_ms": rank(95), "p99_ms": rank(99), "max_ms": round(ordered[-1], 3)}
+
+def bench_ask(books: int, sections: int, requests: int, concurrency: int, llm_latency_ms: float,
+              s3_latency_ms: float, seed: int) -> Dict[str, Any]:
+    """p50/p95/p99 and throughput of lambda_handler /ask over a synthetic corpus."""
+    import handler
+
+    rng = random.Random(seed)
+    vocab = make_vocabulary(4000, rng)
+    s3 = LocalS3()
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix="edubot-bench-"))
+    book_ids = [f"book{i}" for i in range(books)]
+    for book_id in book_ids:
+        publish_book(s3, book_id, make_book(book_id, sections, vocab, rng), tmp / "out")
+    s3.latency = s3_latency_ms / 1000.0
+    questions = [(rng.choice(book_ids), make_question(vocab, rng)) for _ in range(requests)]
+
+    def stub_llm(question, context_sections):
+        time.sleep(llm_latency_ms / 1000.0)
+        return f"Stub answer from {len(context_sections)} sections."
+
+    stages: Dict[str, List[float]] = {}
+    stages_lock = threading.Lock()
+
+    def ask(book_id: str, question: str) -> float:
+        event = {"httpMethod": "POST", "path": "/ask", "body": json.dumps({"question": question, "book_id": book_id})}
+        t0 = time.perf_counter()
+        result = handler.lambda_handler(event, None)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if result["statusCode"] != 200:
+            raise RuntimeError(f"/ask failed: {result['body']}")
+        with stages_lock:
+            for stage, ms in json.loads(result["body"])["timings"].items():
+                stages.setdefault(stage, []).append(ms)
+        return elapsed
+
+    with patch.object(handler, "s3", s3), \
+            patch.object(handler, "_ask_with_bedrock", side_effect=stub_llm), \
+            patch.object(handler, "GEMINI_API_KEY", None), \
+            patch.object(handler, "ANSWER_CACHE_PREFIX", None), \
+            patch.object(handler, "ANSWER_CACHE_DIR", None), \
+            patch.object(handler, "INDEX_DIR", str(tmp / "cache")), \
+            patch.object(handler, "INDEX_CACHE_BYTES", 1 << 40), \
+            open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # stdout is where the handler's EMF metric lines go
+        handler._INDEX_CACHE.clear()
+        handler._ANSWER_CACHE.clear()
+        cold = [ask(book_id, make_question(vocab, rng)) for book_id in book_ids]
+
+        retrieval = []
+        for book_id, question in questions[:min(len(questions), 200)]:
+            t0 = time.perf_counter()
+            handler._top_sections(handler.BUCKET, f"indexes/{book_id}/sections/", handler.TOP_K, question)
+            retrieval.append((time.perf_counter() - t0) * 1000)
+
+        s3.calls.clear()
+        stages.clear()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            warm = list(pool.map(lambda q: ask(*q), questions))
+        wall = time.perf_counter() - t0
+        handler._INDEX_CACHE.clear()
+        handler._ANSWER_CACHE.clear()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "books": books,
+        "sections_per_book": sections,
+        "requests": requests,
+        "concurrency": concurrency,
+        "llm_latency_ms": llm_latency_ms,
+        "s3_latency_ms": s3_latency_ms,
+        "cold": percentiles(cold),
+        "warm": percentiles(warm),
+        "retrieval": percentiles(retrieval),
+        # mean per-stage ms of the warm requests, from the handler's own timings
+        "stages": {stage: round(sum(ms) / len(ms), 3) for stage, ms in stages.items()},
+        "throughput_rps": round(requests / wall, 2),
+        "s3_calls_per_request": round(sum(s3.calls.values()) / max(1, requests), 3)
+    }
+
+COLD_START_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import handler
+imported = time.perf_counter()
+handler.s3._get()
+print(json.dumps(dict(handler._COLD_START, wall_import_ms=(imported - t0) * 1000,
+                      first_client_ms=(time.perf_counter() - imported) * 1000)))
+"""
+
+def bench_cold_start(runs: int) -> Dict[str, Any]:
+    """handler import/init cost in fresh interpreters, and the first S3 client built after it."""
+    env = dict(os.environ, PREWARM_INDEX="false")
+    samples = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", COLD_START_PROBE], cwd=ROOT / "src" / "api",
+                                      env=env, stderr=subprocess.DEVNULL, text=True)
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {"runs": runs, **{metric: percentiles([s[metric] for s in samples])
+                             for metric in ("import_ms", "init_ms", "wall_import_ms", "first_client_ms")}}
+
+def bench_indexer(pages: int, pages_per_block: int, seed: int) -> Dict[str, Any]:
+    """pages/sec and sections/sec of indexer.main() on a synthetic PDF (serial extraction)."""
+    rng = random.Random(seed)
+    vocab = make_vocabulary(4000, rng)
+    texts = [make_text(vocab, 400, rng) for _ in range(pages)]
+
+    class Stream:
+        def __init__(self, data: bytes):
+            self.data = data
+
+        def get_data(self) -> bytes:
+            return self.data
+
+    class Page:
+        def __init__(self, text: str):
+            self.text = text
+            self.page_obj = types.SimpleNamespace(mediabox=[0, 0, 612, 792], contents=[Stream(text.encode("utf-8"))])
+
+        def extract_text(self) -> str:
+            return self.text
+
+        def close(self) -> None:
+            pass
+
+    class Pdf:
+        def __init__(self):
+            self.pages = [Page(text) for text in texts]
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    out = tempfile.mkdtemp(prefix="edubot-bench-index-")
+    argv = ["indexer.py", "--pdf", "bench.pdf", "--book-id", "bench", "--subject", "bench",
+            "--outdir", out, "--pages-per-block", str(pages_per_block)]
+    with patch.dict(sys.modules, {"pdfplumber": types.SimpleNamespace(open=lambda path: Pdf())}), \
+            patch.object(sys, "argv", argv), patch("builtins.print"):
+        t0 = time.perf_counter()
+        indexer.main()
+        elapsed = time.perf_counter() - t0
+    toc = json.loads((pathlib.Path(out) / "bench" / "toc.json").read_text(encoding="utf-8"))
+    sections = len(toc["sections"])
+    shutil.rmtree(out, ignore_errors=True)
+    return {
+        "pages": pages,
+        "pages_per_block": pages_per_block,
+        "sections": sections,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 1),
+        "sections_per_sec": round(sections / elapsed, 1)
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """One line per metric whose value moved between two result files."""
+    lines = []
+    old_runs = {(r["books"], r["sections_per_book"]): r for r in old.get("ask", [])}
+    for run in new.get("ask", []):
+        prev = old_runs.get((run["books"], run["sections_per_book"]))
+        if not prev:
+            continue
+        for phase in ("cold", "warm", "retrieval"):
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                a, b = prev[phase][metric], run[phase][metric]
+                lines.append(f"ask {run['books']}x{run['sections_per_book']} {phase} {metric}: "
+                             f"{a} -> {b} ({(b - a) / a * 100 if a else 0:+.1f}%)")
+    if old.get("cold_start") and new.get("cold_start"):
+        for metric in ("wall_import_ms", "first_client_ms"):
+            a, b = old["cold_start"][metric]["p50_ms"], new["cold_start"][metric]["p50_ms"]
+            lines.append(f"cold start {metric} p50: {a} -> {b} ({(b - a) / a * 100 if a else 0:+.1f}%)")
+    if old.get("indexer") and new.get("indexer"):
+        for metric in ("pages_per_sec", "sections_per_sec"):
+            a, b = old["indexer"][metric], new["indexer"][metric]
+            lines.append(f"indexer {metric}: {a} -> {b} ({(b - a) / a * 100 if a else 0:+.1f}%)")
+    return lines
+
+def main():
+    ap = argparse.ArgumentParser(description="EduBot benchmarks: /ask latency and indexer throughput, offline")
+    ap.add_argument("--books", type=int, default=3, help="Books in the synthetic corpus")
+    ap.add_argument("--sections", default="200,1000,5000", help="Comma-separated sections per book to run")
+    ap.add_argument("--requests", type=int, default=200, help="Warm /ask requests per corpus size")
+    ap.add_argument("--concurrency", type=int, default=8, help="Concurrent /ask callers")
+    ap.add_argument("--llm-latency-ms", type=float, default=0.0, help="Stub LLM latency per call")
+    ap.add_argument("--s3-latency-ms", type=float, default=0.0, help="Local S3 latency per call")
+    ap.add_argument("--pages", type=int, default=300, help="Pages in the synthetic PDF for the indexer run (0 skips)")
+    ap.add_argument("--pages-per-block", type=int, default=3)
+    ap.add_argument("--cold-starts", type=int, default=5, help="Fresh-interpreter handler imports to time (0 skips)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", help="Write results JSON here (default: stdout)")
+    ap.add_argument("--compare", help="Previous results JSON to diff against")
+    args = ap.parse_args()
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": indexer.np.__version__ if indexer.np is not None else None,
+        "created_at": int(time.time()),
+        "args": vars(args),
+        "ask": [],
+        "cold_start": None,
+        "indexer": None
+    }
+    for sections in (int(s) for s in args.sections.split(",") if s.strip()):
+        run = bench_ask(args.books, sections, args.requests, args.concurrency, args.llm_latency_ms,
+                        args.s3_latency_ms, args.seed)
+        results["ask"].append(run)
+        print(f"/ask {args.books}x{sections}: warm p50 {run['warm']['p50_ms']}ms p95 {run['warm']['p95_ms']}ms "
+              f"p99 {run['warm']['p99_ms']}ms, {run['throughput_rps']} req/s; "
+              f"cold p50 {run['cold']['p50_ms']}ms; retrieval p50 {run['retrieval']['p50_ms']}ms", file=sys.stderr)
+    if args.cold_starts > 0:
+        results["cold_start"] = bench_cold_start(args.cold_starts)
+        print(f"cold start: import p50 {results['cold_start']['wall_import_ms']['p50_ms']}ms, "
+              f"first S3 client p50 {results['cold_start']['first_client_ms']['p50_ms']}ms", file=sys.stderr)
+    if args.pages > 0:
+        results["indexer"] = bench_indexer(args.pages, args.pages_per_block, args.seed)
+        print(f"indexer: {results['indexer']['pages_per_sec']} pages/s, "
+              f"{results['indexer']['sections_per_sec']} sections/s", file=sys.stderr)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        pathlib.Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        old = json.loads(pathlib.Path(args.compare).read_text(encoding="utf-8"))
+        for line in compare(old, results):
+            print(line, file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ S3_PDF_KEY = os.environ["S3_PDF_KEY"]    # e.g., philosophy/philosophy-textbook.
 S3_INDEX_PREFIX = os.environ.get("S3_INDEX_PREFIX", f"indexes/{BOOK_ID}")
 KMS_ALIAS = os.environ.get("KMS_ALIAS", "alias/edubot-mvp-kms")
 PAGES_PER_BLOCK = int(os.environ.get("PAGES_PER_BLOCK", "3"))
+INCREMENTAL = os.environ.get("INCREMENTAL", "true") == "true"
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
 
 s3 = boto3.client("s3")
 
@@ -15,11 +17,25 @@ def sh(args):
     print("+", " ".join(map(str,args)))
     subprocess.check_call(args)
 
+def fetch_previous_index(outdir):
+    """Pull the last run's manifest.json + index.bin so the indexer can skip unchanged pages."""
+    base = pathlib.Path(outdir) / BOOK_ID
+    base.mkdir(parents=True, exist_ok=True)
+    try:
+        for name in ("manifest.json", "index.bin"):
+            s3.download_file(BUCKET, f"{S3_INDEX_PREFIX.rstrip('/')}/{name}", str(base / name))
+    except Exception as e:
+        print(f"No previous index to reuse ({e}); running a full index")
+        return False
+    return True
+
 def main():
     pdf_local = f"/tmp/{pathlib.Path(S3_PDF_KEY).name}"
     print(f"Downloading s3://{BUCKET}/{S3_PDF_KEY} -> {pdf_local}")
     s3.download_file(BUCKET, S3_PDF_KEY, pdf_local)
 
+    incremental = INCREMENTAL and fetch_previous_index("/tmp/indexes")
+
     # run your existing indexer to emit local JSON and upload to S3 with SSE-KMS
     sh([
         "python", "/var/task/indexer.py",
@@ -28,10 +44,11 @@ def main():
         "--subject", SUBJECT,
         "--outdir", "/tmp/indexes",
         "--pages-per-block", str(PAGES_PER_BLOCK),
+        "--workers", str(EXTRACT_WORKERS),
         "--s3-bucket", BUCKET,
         "--s3-prefix", S3_INDEX_PREFIX,
         "--kms-alias", KMS_ALIAS
-    ])
+    ] + (["--incremental"] if incremental else []))
     print("Indexing complete.")
 
 if __name__ == "__main__":
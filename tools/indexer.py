@@ -1,15 +1,62 @@
 #!/usr/bin/env python3
-import argparse, json, os, re, time, uuid, pathlib
-from typing import List, Dict, Any, Tuple, Optional
+import argparse, base64, hashlib, itertools, json, math, mmap, os, re, shutil, struct, tempfile, threading, time, uuid, pathlib
+from collections import deque
+from typing import List, Dict, Any, Iterable, Iterator, Tuple, Optional
 
 #Purpose: index & index textbooks
 
+SHARD_FORMAT = "edubot-shard/1"
+BM25_FORMAT = "edubot-bm25/1"
+MANIFEST_FORMAT = "edubot-manifest/1"
+
+# index.bin layout (little-endian), read by src/api/handler.py via mmap:
+#   header  magic(8s) version(I) section_count(I) meta_len(I)
+#   table   section_count x [offset(Q) length(I)], byte spans into the blob
+#   meta    compact UTF-8 JSON: book fields + [section_id, title, page_start, page_end] rows
+#           + "sentences": per section, the character offsets where its 2nd.. sentences start
+#   blob    every section's text, UTF-8, back to back
+BINARY_MAGIC = b"EDUIDX01"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<8sIII")
+BINARY_SPAN = struct.Struct("<QI")
+
+# lsa.bin layout (little-endian), also read by src/api/handler.py:
+#   header  magic(8s) version(I) doc_count(I) term_count(I) dims(I) meta_len(I)
+#   meta    compact UTF-8 JSON {doc_ids, terms, idf}, space-padded to a multiple of 4 bytes
+#   docs    doc_count x dims float32, unit-length LSA vectors in doc_ids order
+#   terms   term_count x dims float32, folds a TF-IDF query vector into the same space
+LSA_MAGIC = b"EDULSA01"
+LSA_VERSION = 1
+LSA_HEADER = struct.Struct("<8sIIIII")
+LSA_MAX_TERMS = 30000
+
+# Upper bound on page blocks per range handed to an extraction worker, so the
+# blocks a worker returns in one piece stay small however long the book is
+RANGE_MAX_BLOCKS = 16
+
+# Keep in sync with src/api/handler.py: query and index must tokenize alike
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his how i in into is it its
+of on or our she so than that the their them then there these they this to was we
+were what when where which who whom why will with you your
+""".split())
+# Keep in sync with src/api/handler.py: a sentence ends at . ! or ? (plus closing quotes/brackets) and
+# whitespace, before something that can start one
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]\u201d\u2019]*\s+(?=[A-Z0-9\"'(\[\u201c\u2018])")
+
 # Optional upload
 try:
     import boto3
 except Exception:
     boto3 = None
 
+# Optional LSA vectors (lsa.bin)
+try:
+    import numpy as np
+except Exception:
+    np = None
+
 # --- helpers ---
 def normalize_ws(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
@@ -34,54 +81,630 @@ def chunk_paragraphs(paragraphs: List[str], max_chars: int = 1800) -> List[str]:
     return chunks
 
 # --- PDF extraction (by pages, then chunk) ---
-def extract_pdf_to_chunks(pdf_path: str, pages_per_block: int = 3) -> List[Dict[str, Any]]:
+def iter_page_blocks(pdf_path: str, pages_per_block: int, first_page: int = 0,
+                     last_page: Optional[int] = None) -> Iterator[Tuple[int, int, str, str]]:
+    """(start, end, normalized text, fingerprint) per block of pages in [first_page, last_page).
+
+    first_page must be block-aligned. The fingerprint (see block_fingerprint) is
+    taken while the page is open anyway, so a full run needs no separate hashing
+    pass. Each page's parsed layout is released once its text is out, so memory
+    does not grow with the page count.
+    """
     import pdfplumber
-    chunks_all: List[Dict[str, Any]] = []
     with pdfplumber.open(pdf_path) as pdf:
-        total_pages = len(pdf.pages)
-        block_id = 0
-        for start in range(0, total_pages, pages_per_block):
+        total_pages = len(pdf.pages) if last_page is None else min(last_page, len(pdf.pages))
+        for start in range(first_page, total_pages, pages_per_block):
             end = min(start + pages_per_block, total_pages)
             texts = []
+            h = hashlib.sha256()
             for i in range(start, end):
                 page = pdf.pages[i]
+                h.update(page_fingerprint(page).encode("utf-8"))
                 try:
                     texts.append(page.extract_text() or "")
                 except Exception:
                     texts.append("")
-            block_text = "\n".join(texts)
-            block_text = normalize_ws(block_text)
-            if not block_text:
-                continue
-            # paragraph-based sub-chunking for more even sizes
-            paragraphs = split_paragraphs(block_text)
-            for subidx, chunk in enumerate(chunk_paragraphs(paragraphs, max_chars=1800)):
-                chunks_all.append({
-                    "block_index": block_id,
-                    "sub_index": subidx,
-                    "page_start": start + 1,   # 1-based for humans
-                    "page_end": end,
-                    "text": chunk
-                })
-            block_id += 1
-    return chunks_all
+                if hasattr(page, "close"):
+                    page.close()
+            yield start, end, normalize_ws("\n".join(texts)), h.hexdigest()
+
+def extract_page_blocks(pdf_path: str, pages_per_block: int, first_page: int = 0,
+                        last_page: Optional[int] = None) -> List[Tuple[int, int, str, str]]:
+    """iter_page_blocks as a list; opens the PDF itself so it can run in a worker process."""
+    return list(iter_page_blocks(pdf_path, pages_per_block, first_page, last_page))
+
+def page_ranges(total_pages: int, pages_per_block: int, parts: int,
+                max_blocks: int = RANGE_MAX_BLOCKS) -> List[Tuple[int, int]]:
+    """Split [0, total_pages) into about `parts` contiguous, block-aligned ranges of
+    at most max_blocks blocks each (more ranges than `parts` for long books)."""
+    blocks = (total_pages + pages_per_block - 1) // pages_per_block
+    per_part = max(1, min(max_blocks, -(-blocks // max(1, parts))))
+    return [(b * pages_per_block, min((b + per_part) * pages_per_block, total_pages))
+            for b in range(0, blocks, per_part)]
+
+def chunk_block(block_text: str) -> List[str]:
+    if not block_text:
+        return []
+    # paragraph-based sub-chunking for more even sizes
+    return chunk_paragraphs(split_paragraphs(block_text), max_chars=1800)
+
+def number_chunks(blocks: Iterable[Tuple[int, int, List[str]]]) -> Iterator[Dict[str, Any]]:
+    """Number blocks that have chunks in page order; empty blocks get no block_index."""
+    block_id = 0
+    for start, end, chunks in blocks:
+        if not chunks:
+            continue
+        for subidx, chunk in enumerate(chunks):
+            yield {
+                "block_index": block_id,
+                "sub_index": subidx,
+                "page_start": start + 1,   # 1-based for humans
+                "page_end": end,
+                "text": chunk
+            }
+        block_id += 1
+
+def chunks_from_blocks(blocks: Iterable[Tuple[int, int, str, str]]) -> List[Dict[str, Any]]:
+    """Number non-empty blocks in page order and sub-chunk them."""
+    return list(number_chunks((start, end, chunk_block(text)) for start, end, text, _ in blocks))
+
+def iter_extracted(pdf_path: str, pages_per_block: int, ranges: List[Tuple[int, int]],
+                   workers: int = 1) -> Iterator[Tuple[int, int, str, str]]:
+    """Page blocks of several block-aligned page ranges, in range order.
+
+    With workers > 1 the ranges go to a process pool, at most two per worker in
+    flight, so finished ranges wait for the consumer instead of piling up.
+    """
+    if workers <= 1 or len(ranges) <= 1:
+        for first, last in ranges:
+            yield from iter_page_blocks(pdf_path, pages_per_block, first, last)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    todo = iter(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(extract_page_blocks, pdf_path, pages_per_block, first, last)
+                        for first, last in itertools.islice(todo, workers * 2))
+        while pending:
+            blocks = pending.popleft().result()
+            for first, last in itertools.islice(todo, 1):
+                pending.append(pool.submit(extract_page_blocks, pdf_path, pages_per_block, first, last))
+            yield from blocks
+
+def pdf_page_count(pdf_path: str) -> int:
+    import pdfplumber
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def extract_pdf_to_chunks(pdf_path: str, pages_per_block: int = 3, workers: int = 1) -> List[Dict[str, Any]]:
+    if workers <= 1:
+        return chunks_from_blocks(iter_page_blocks(pdf_path, pages_per_block))
+
+    # A few ranges per worker keeps the pool busy when some pages are slower
+    ranges = page_ranges(pdf_page_count(pdf_path), pages_per_block, workers * 4)
+    return chunks_from_blocks(iter_extracted(pdf_path, pages_per_block, ranges, workers))
+
+# --- incremental re-indexing ---
+def page_fingerprint(page) -> str:
+    """Hash of a page's raw content streams and media box.
+
+    Changes whenever the page does, without pdfplumber's layout analysis. The
+    streams are hashed as stored (still compressed): decoding them would keep
+    the decoded copy on the page object until the PDF is closed. Take it before
+    extracting the page's text, which decodes them. Falls back to hashing the
+    extracted text if the streams cannot be read.
+    """
+    h = hashlib.sha256()
+    try:
+        page_obj = page.page_obj
+        h.update(repr(list(page_obj.mediabox)).encode("utf-8"))
+        contents = page_obj.contents or []
+        for ref in contents if isinstance(contents, list) else [contents]:
+            stream = ref.resolve() if hasattr(ref, "resolve") else ref
+            raw = getattr(stream, "rawdata", None)
+            h.update(raw if raw is not None else stream.get_data())
+    except Exception:
+        h = hashlib.sha256(("text:" + (page.extract_text() or "")).encode("utf-8"))
+    return h.hexdigest()
+
+def fingerprint_blocks(pdf_path: str, pages_per_block: int) -> List[Tuple[int, int, str]]:
+    """(start, end, hash) for every block of pages, from page_fingerprint.
+
+    Only --incremental runs with a previous manifest need this pass (to pick the
+    blocks to extract). Nothing is decoded, and each page is closed once hashed.
+    """
+    import pdfplumber
+    blocks: List[Tuple[int, int, str]] = []
+    with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
+        for start in range(0, total_pages, pages_per_block):
+            end = min(start + pages_per_block, total_pages)
+            h = hashlib.sha256()
+            for i in range(start, end):
+                page = pdf.pages[i]
+                h.update(page_fingerprint(page).encode("utf-8"))
+                if hasattr(page, "close"):
+                    page.close()
+            blocks.append((start, end, h.hexdigest()))
+    return blocks
+
+def text_sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class PreviousTexts:
+    """Section texts of a previous run's index.bin, sliced out of an mmap on demand."""
+
+    def __init__(self, path: pathlib.Path):
+        self._file = path.open("rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, count, meta_len = BINARY_HEADER.unpack_from(self._mm, 0)
+        if magic != BINARY_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an EduBot binary index")
+        meta_start = BINARY_HEADER.size + count * BINARY_SPAN.size
+        meta = json.loads(self._mm[meta_start:meta_start + meta_len].decode("utf-8"))
+        blob_start = meta_start + meta_len
+        spans = BINARY_SPAN.iter_unpack(self._mm[BINARY_HEADER.size:meta_start])
+        self._spans = {row[0]: (blob_start + offset, length) for row, (offset, length) in zip(meta["sections"], spans)}
+
+    def get(self, section_id: str, default: Optional[str] = None) -> Optional[str]:
+        span = self._spans.get(section_id)
+        if span is None:
+            return default
+        return self._mm[span[0]:span[0] + span[1]].decode("utf-8")
+
+    def __getitem__(self, section_id: str) -> str:
+        text = self.get(section_id)
+        if text is None:
+            raise KeyError(section_id)
+        return text
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+def load_previous(base: pathlib.Path) -> Tuple[Optional[Dict[str, Any]], Optional[PreviousTexts]]:
+    """Manifest and section texts (from index.bin) of the previous run in base, if any."""
+    manifest_path, binary_path = base / "manifest.json", base / "index.bin"
+    if not manifest_path.exists() or not binary_path.exists():
+        return None, None
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    return manifest, PreviousTexts(binary_path)
+
+def reusable_blocks(block_hashes: List[Tuple[int, int, str]], manifest: Optional[Dict[str, Any]],
+                    texts: Optional[PreviousTexts], pages_per_block: int) -> Dict[int, List[str]]:
+    """Section IDs of the previous run for blocks whose pages are unchanged, by block start page.
+
+    Only IDs are kept; the texts are checked against the manifest here and read
+    again from `texts` when the block comes up for writing.
+    """
+    if not manifest or texts is None or manifest.get("pages_per_block") != pages_per_block:
+        return {}
+    prev = {(b["page_start"], b["page_end"], b["hash"]): b for b in manifest.get("blocks", [])}
+    reuse: Dict[int, List[str]] = {}
+    for start, end, h in block_hashes:
+        block = prev.get((start + 1, end, h))
+        if block is None:
+            continue
+        ok = True
+        for sec in block["sections"]:
+            text = texts.get(sec["section_id"])
+            if text is None or text_sha(text) != sec["sha"]:
+                ok = False
+                break
+        if ok:
+            reuse[start] = [sec["section_id"] for sec in block["sections"]]
+    return reuse
+
+def dirty_ranges(block_hashes: List[Tuple[int, int, str]], reuse: Dict[int, List[str]],
+                 parts: int, max_blocks: int = RANGE_MAX_BLOCKS) -> List[Tuple[int, int]]:
+    """Page ranges covering the blocks that must be extracted, split into about `parts`
+    pieces of at most max_blocks blocks each."""
+    dirty = [(start, end) for start, end, _ in block_hashes if start not in reuse]
+    per_part = max(1, min(max_blocks, -(-len(dirty) // max(1, parts))))
+    ranges: List[Tuple[int, int]] = []
+    run: List[Tuple[int, int]] = []
+    for start, end in dirty:
+        if run and (run[-1][1] != start or len(run) >= per_part):
+            ranges.append((run[0][0], run[-1][1]))
+            run = []
+        run.append((start, end))
+    if run:
+        ranges.append((run[0][0], run[-1][1]))
+    return ranges
+
+def fresh_blocks(extracted: Iterator[Tuple[int, int, str, str]],
+                 block_hashes: List[Tuple[int, int, str]]) -> Iterator[Tuple[int, int, List[str]]]:
+    """(start, end, chunks) for every block when nothing is reused; each block's
+    (start, end, hash) is appended to block_hashes for the manifest as it passes."""
+    for start, end, text, h in extracted:
+        block_hashes.append((start, end, h))
+        yield start, end, chunk_block(text)
+
+def merge_blocks(block_hashes: List[Tuple[int, int, str]], reuse: Dict[int, List[str]],
+                 texts: Optional[PreviousTexts],
+                 extracted: Iterator[Tuple[int, int, str, str]]) -> Iterator[Tuple[int, int, List[str]]]:
+    """(start, end, chunks) for every block in page order: reused chunks come from
+    texts, the rest from `extracted`, which yields exactly the dirty blocks in order."""
+    for start, end, _ in block_hashes:
+        if start in reuse:
+            yield start, end, [texts[section_id] for section_id in reuse[start]]
+            continue
+        got_start, _, text, _ = next(extracted)
+        if got_start != start:
+            raise RuntimeError(f"extracted block at page {got_start + 1}, expected {start + 1}")
+        yield start, end, chunk_block(text)
+
+def build_manifest(book_id: str, pages_per_block: int, block_hashes: List[Tuple[int, int, str]],
+                   section_shas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """section_shas: {section_id, page_start, sha} per section, in order."""
+    by_start: Dict[int, List[Dict[str, str]]] = {}
+    for sec in section_shas:
+        by_start.setdefault(sec["page_start"], []).append({"section_id": sec["section_id"], "sha": sec["sha"]})
+    return {
+        "format": MANIFEST_FORMAT,
+        "book_id": book_id,
+        "pages_per_block": pages_per_block,
+        "blocks": [{"page_start": start + 1, "page_end": end, "hash": h, "sections": by_start.get(start + 1, [])}
+                   for start, end, h in block_hashes]
+    }
+
+def sentence_starts(text: str) -> List[int]:
+    """Character offsets where each sentence after the first begins; /ask cuts snippets there."""
+    return [m.end() for m in SENTENCE_END_RE.finditer(text) if m.end() < len(text)]
 
 def write_json(path: pathlib.Path, obj: Any) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
 
-def upload_dir_to_s3(local_dir: pathlib.Path, bucket: str, prefix: str, kms_alias: str) -> None:
+def build_shard(toc: Dict[str, Any], section_objs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Pack every section of a book into one object: toc metadata, an offset
+    table, and a single text blob. /ask loads this with one GET."""
+    entries, parts, offset = [], [], 0
+    for sec in section_objs:
+        text = sec["text"]
+        entries.append({
+            "section_id": sec["section_id"],
+            "title": sec["title"],
+            "page_start": sec["page_start"],
+            "page_end": sec["page_end"],
+            "offset": offset,          # character offset into "text"
+            "length": len(text),
+            "sentences": sec.get("sentences") or sentence_starts(text)
+        })
+        parts.append(text)
+        offset += len(text)
+    shard = {k: v for k, v in toc.items() if k != "sections"}
+    shard["format"] = SHARD_FORMAT
+    shard["sections"] = entries
+    shard["text"] = "".join(parts)
+    return shard
+
+class ShardWriter:
+    """Writes the same compact shard.json as build_shard one section at a time.
+
+    The offset table stays in memory; text goes, JSON-escaped, to a spool file
+    that close() copies in after the table. The file is replaced atomically.
+    """
+
+    def __init__(self, path: pathlib.Path, toc: Dict[str, Any]):
+        self.path = path
+        self.header = {k: v for k, v in toc.items() if k != "sections"}
+        self.entries: List[Dict[str, Any]] = []
+        self.offset = 0
+        self.spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    def add(self, sec: Dict[str, Any]) -> None:
+        text = sec["text"]
+        self.entries.append({
+            "section_id": sec["section_id"],
+            "title": sec["title"],
+            "page_start": sec["page_start"],
+            "page_end": sec["page_end"],
+            "offset": self.offset,
+            "length": len(text),
+            "sentences": sec.get("sentences") or sentence_starts(text)
+        })
+        self.spool.write(json.dumps(text, ensure_ascii=False)[1:-1])
+        self.offset += len(text)
+
+    def close(self) -> None:
+        head = dict(self.header, format=SHARD_FORMAT, sections=self.entries)
+        head_json = json.dumps(head, ensure_ascii=False, separators=(",", ":"))
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        self.spool.seek(0)
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(head_json[:-1] + ',"text":"')
+            shutil.copyfileobj(self.spool, f)
+            f.write('"}')
+        self.spool.close()
+        os.replace(tmp, self.path)
+
+class BinaryIndexWriter:
+    """Writes index.bin (layout above) one section at a time.
+
+    Spans and metadata rows stay in memory; section bytes go to a spool file
+    that close() copies in after the header, table and metadata.
+    """
+
+    def __init__(self, path: pathlib.Path, toc: Dict[str, Any]):
+        self.path = path
+        self.meta = {k: v for k, v in toc.items() if k != "sections"}
+        self.rows: List[List[Any]] = []
+        self.sentences: List[List[int]] = []
+        self.spans: List[Tuple[int, int]] = []
+        self.offset = 0
+        self.spool = tempfile.TemporaryFile()
+
+    def add(self, sec: Dict[str, Any]) -> None:
+        data = sec["text"].encode("utf-8")
+        self.spool.write(data)
+        self.spans.append((self.offset, len(data)))
+        self.rows.append([sec["section_id"], sec["title"], sec["page_start"], sec["page_end"]])
+        # A separate list keeps the 4-field rows readable by older handlers
+        self.sentences.append(sec.get("sentences") or sentence_starts(sec["text"]))
+        self.offset += len(data)
+
+    def close(self) -> None:
+        meta = dict(self.meta, sections=self.rows, sentences=self.sentences)
+        meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        self.spool.seek(0)
+        with tmp.open("wb") as f:
+            f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(self.spans), len(meta_bytes)))
+            for offset, length in self.spans:
+                f.write(BINARY_SPAN.pack(offset, length))
+            f.write(meta_bytes)
+            shutil.copyfileobj(self.spool, f)
+        self.spool.close()
+        os.replace(tmp, self.path)
+
+def write_binary_index(path: pathlib.Path, toc: Dict[str, Any], section_objs: List[Dict[str, Any]]) -> None:
+    """Write the mmap-friendly index.bin (layout above)."""
+    writer = BinaryIndexWriter(path, toc)
+    for sec in section_objs:
+        writer.add(sec)
+    writer.close()
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+class Bm25Builder:
+    """Accumulates BM25 postings one section at a time; build() adds the IDFs."""
+
+    def __init__(self):
+        self.postings: Dict[str, List[List[int]]] = {}
+        self.doc_ids: List[str] = []
+        self.doc_len: List[int] = []
+
+    def add(self, section_id: str, text: str) -> None:
+        doc = len(self.doc_ids)
+        counts: Dict[str, int] = {}
+        tokens = tokenize(text)
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            self.postings.setdefault(tok, []).append([doc, tf])
+        self.doc_ids.append(section_id)
+        self.doc_len.append(len(tokens))
+
+    def build(self) -> Dict[str, Any]:
+        n = len(self.doc_ids)
+        idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self.postings.items()}
+        return {
+            "format": BM25_FORMAT,
+            "doc_ids": self.doc_ids,
+            "doc_len": self.doc_len,
+            "avgdl": (sum(self.doc_len) / n) if n else 0.0,
+            "idf": idf,
+            "postings": self.postings
+        }
+
+def build_bm25_index(section_objs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Inverted index for BM25: postings of [doc, term frequency], document
+    lengths and per-term IDF. Doc numbers index into doc_ids."""
+    builder = Bm25Builder()
+    for sec in section_objs:
+        builder.add(sec["section_id"], sec["text"])
+    return builder.build()
+
+def _sparse_dot(rows, cols, vals, m, n_out: int, chunk: int = 1 << 16):
+    """(rows, cols, vals) sparse matrix, sorted by rows, times dense m, in bounded chunks."""
+    out = np.zeros((n_out, m.shape[1]))
+    for i in range(0, len(vals), chunk):
+        r = rows[i:i + chunk]
+        prod = vals[i:i + chunk, None] * m[cols[i:i + chunk]]
+        starts = np.flatnonzero(np.r_[True, r[1:] != r[:-1]])
+        out[r[starts]] += np.add.reduceat(prod, starts, axis=0)
+    return out
+
+def lsa_vectors(index: Dict[str, Any], dims: int = 128, max_terms: int = LSA_MAX_TERMS,
+                seed: int = 0) -> Optional[Dict[str, Any]]:
+    """Truncated SVD of the book's TF-IDF matrix, built from the BM25 postings.
+
+    Weights are (1 + log tf) * idf with unit-length document rows; terms seen in
+    a single section carry no co-occurrence signal and are left out. Uses a
+    randomized range finder so only the sparse matrix and a few dense
+    doc x (dims + 10) blocks are ever held. None without numpy or with too
+    little text to factor.
+    """
+    if np is None:
+        return None
+    postings = index["postings"]
+    n_docs = len(index["doc_ids"])
+    vocab = sorted(sorted((t for t, p in postings.items() if len(p) >= 2),
+                          key=lambda t: -len(postings[t]))[:max_terms])
+    k = min(dims, n_docs - 1, len(vocab) - 1)
+    if k < 1:
+        return None
+
+    rows, cols, vals = [], [], []
+    for col, term in enumerate(vocab):
+        idf = index["idf"][term]
+        for doc, tf in postings[term]:
+            rows.append(doc)
+            cols.append(col)
+            vals.append((1 + math.log(tf)) * idf)
+    rows, cols, vals = np.array(rows), np.array(cols), np.array(vals)
+    norms = np.sqrt(np.bincount(rows, vals * vals, minlength=n_docs))
+    vals = vals / norms[rows]
+    by_doc = np.argsort(rows, kind="stable")
+    by_term = np.argsort(cols, kind="stable")
+
+    def x_dot(m):   # X @ m, X is docs x terms
+        return _sparse_dot(rows[by_doc], cols[by_doc], vals[by_doc], m, n_docs)
+
+    def xt_dot(m):  # X.T @ m
+        return _sparse_dot(cols[by_term], rows[by_term], vals[by_term], m, len(vocab))
+
+    rng = np.random.default_rng(seed)
+    width = min(k + 10, n_docs, len(vocab))
+    y = x_dot(rng.standard_normal((len(vocab), width)))
+    for _ in range(2):  # power iterations sharpen the spectrum of text matrices
+        y = x_dot(xt_dot(np.linalg.qr(y)[0]))
+    q = np.linalg.qr(y)[0]
+    ub, s, vt = np.linalg.svd(xt_dot(q).T, full_matrices=False)
+    docs = (q @ ub[:, :k]) * s[:k]
+    lengths = np.linalg.norm(docs, axis=1, keepdims=True)
+    docs = np.divide(docs, lengths, out=np.zeros_like(docs), where=lengths > 0)
+    return {
+        "doc_ids": index["doc_ids"],
+        "terms": vocab,
+        "idf": [index["idf"][t] for t in vocab],
+        "docs": docs.astype(np.float32),
+        "vectors": vt[:k].T.astype(np.float32)
+    }
+
+def write_lsa(path: pathlib.Path, lsa: Dict[str, Any]) -> None:
+    """Write lsa.bin (layout above)."""
+    meta = json.dumps({"doc_ids": lsa["doc_ids"], "terms": lsa["terms"], "idf": lsa["idf"]},
+                      ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    meta += b" " * (-(LSA_HEADER.size + len(meta)) % 4)
+    docs, vectors = lsa["docs"], lsa["vectors"]
+    with path.open("wb") as f:
+        f.write(LSA_HEADER.pack(LSA_MAGIC, LSA_VERSION, docs.shape[0], vectors.shape[0], docs.shape[1], len(meta)))
+        f.write(meta)
+        f.write(np.ascontiguousarray(docs, dtype="<f4").tobytes())
+        f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+
+def file_md5(path: pathlib.Path) -> str:
+    h = hashlib.md5()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def make_s3_client(workers: int):
     if boto3 is None:
         raise RuntimeError("boto3 not installed. Run: pip install boto3")
-    s3 = boto3.client("s3")
-    for root, _, files in os.walk(local_dir):
-        for name in files:
-            full = pathlib.Path(root) / name
-            rel = full.relative_to(local_dir)
-            key = f"{prefix.rstrip('/')}/{rel.as_posix()}"
-            s3.upload_file(str(full), bucket, key)
-            print(f"Uploaded: s3://{bucket}/{key}")
+    from botocore.config import Config
+    # One pooled connection per upload worker; adaptive retries absorb S3 503 SlowDown
+    return boto3.client("s3", config=Config(max_pool_connections=max(10, workers),
+                                            retries={"max_attempts": 10, "mode": "adaptive"}))
+
+class Uploader:
+    """Background SSE-KMS uploads of files under local_dir on a bounded thread pool.
+
+    Objects whose stored MD5 already matches are skipped. submit() blocks while
+    4 x workers files are queued, so a producer outrunning S3 stays bounded.
+    """
+
+    def __init__(self, local_dir: pathlib.Path, bucket: str, prefix: str, kms_alias: str,
+                 workers: int = 16, s3=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.local_dir, self.bucket, self.kms_alias = local_dir, bucket, kms_alias
+        self.prefix = prefix.rstrip("/")
+        self.s3 = s3 or make_s3_client(workers)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.slots = threading.BoundedSemaphore(max(1, workers) * 4)
+        self.lock = threading.Lock()
+        self.pending: set = set()
+        self.errors: List[BaseException] = []
+        self.counts = {"uploaded": 0, "skipped": 0, "bytes": 0}
+        self.t0 = time.time()
+
+    def _upload(self, rel: str) -> None:
+        path = self.local_dir / rel
+        key = f"{self.prefix}/{rel}"
+        md5 = file_md5(path)
+        size = path.stat().st_size
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=key)
+            # SSE-KMS ETags are not MD5s, so the MD5 also travels as user metadata
+            if head.get("Metadata", {}).get("md5") == md5 or head.get("ETag", "").strip('"') == md5:
+                with self.lock:
+                    self.counts["skipped"] += 1
+                return
+        except Exception:
+            pass  # missing (404) or unreadable: upload it
+        with path.open("rb") as f:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=f,
+                               ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode("ascii"),
+                               ServerSideEncryption="aws:kms", SSEKMSKeyId=self.kms_alias,
+                               Metadata={"md5": md5})
+        with self.lock:
+            self.counts["uploaded"] += 1
+            self.counts["bytes"] += size
+
+    def _done(self, fut) -> None:
+        with self.lock:
+            self.pending.discard(fut)
+            if fut.exception() is not None:
+                self.errors.append(fut.exception())
+        self.slots.release()
+
+    def submit(self, rel: str) -> None:
+        """Queue local_dir/rel for upload to prefix/rel."""
+        self.slots.acquire()
+        fut = self.pool.submit(self._upload, rel)
+        with self.lock:
+            self.pending.add(fut)
+        fut.add_done_callback(self._done)
+
+    def wait(self) -> None:
+        """Block until everything submitted so far is uploaded; re-raise the first failure."""
+        from concurrent.futures import wait
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        if self.errors:
+            raise self.errors[0]
+
+    def close(self, delete: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Finish uploads, delete `delete` under prefix and return the summary it prints."""
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown(wait=True)
+        delete = delete or []
+        for i in range(0, len(delete), 1000):
+            batch = [{"Key": f"{self.prefix}/{rel}"} for rel in delete[i:i + 1000]]
+            self.s3.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+
+        elapsed = max(time.time() - self.t0, 1e-6)
+        summary = dict(self.counts, deleted=len(delete), seconds=round(elapsed, 3))
+        objects = summary["uploaded"] + summary["skipped"]
+        print(f"s3://{self.bucket}/{self.prefix}/: uploaded {summary['uploaded']} objects "
+              f"({summary['bytes'] / 1e6:.1f} MB), skipped {summary['skipped']} unchanged, "
+              f"deleted {summary['deleted']} in {elapsed:.1f}s "
+              f"({summary['bytes'] / 1e6 / elapsed:.1f} MB/s, {objects / elapsed:.0f} objects/s)")
+        return summary
+
+def upload_dir_to_s3(local_dir: pathlib.Path, bucket: str, prefix: str, kms_alias: str,
+                     only: Optional[List[str]] = None, delete: Optional[List[str]] = None,
+                     workers: int = 16, s3=None) -> Dict[str, Any]:
+    """Upload local_dir (or just the relative paths in `only`) with SSE-KMS on a
+    bounded thread pool, skipping objects whose stored MD5 already matches, then
+    delete `delete` under prefix. Returns the summary it prints."""
+    uploader = Uploader(local_dir, bucket, prefix, kms_alias, workers=workers, s3=s3)
+    if only is None:
+        only = sorted((pathlib.Path(root) / name).relative_to(local_dir).as_posix()
+                      for root, _, files in os.walk(local_dir) for name in files)
+    for rel in only:
+        uploader.submit(rel)
+    return uploader.close(delete)
 
 def main():
     ap = argparse.ArgumentParser(description="EduBot indexer: PDF -> JSON chunks + toc.json")
@@ -90,25 +713,68 @@ def main():
     ap.add_argument("--subject", required=True, help="High-level subject folder, e.g. 'philosophy', 'history'")
     ap.add_argument("--outdir", default="indexes", help="Output base directory (local)")
     ap.add_argument("--pages-per-block", type=int, default=3, help="Pages grouped per block before sub-chunking")
+    ap.add_argument("--workers", type=int, default=1, help="Processes extracting page blocks in parallel")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Reuse unchanged page blocks from manifest.json + index.bin already in outdir")
+    ap.add_argument("--lsa-dims", type=int, default=128,
+                    help="Dimensions of the LSA vectors in lsa.bin (needs numpy; 0 skips it)")
     ap.add_argument("--s3-bucket", help="If set, upload output to this S3 bucket")
     ap.add_argument("--s3-prefix", help="S3 prefix (e.g., 'indexes/philosophy') -- defaults to 'indexes/<book-id>'")
     ap.add_argument("--kms-alias", default="alias/edubot-mvp-kms", help="KMS alias for SSE-KMS")
+    ap.add_argument("--upload-workers", type=int, default=16, help="Concurrent S3 uploads")
     args = ap.parse_args()
 
     pdf_path = pathlib.Path(args.pdf).expanduser().resolve()
     ts = int(time.time())
 
-    # Extract chunks
-    chunks = extract_pdf_to_chunks(str(pdf_path), pages_per_block=args.pages_per_block)
-
     # Prepare output structure
     base = pathlib.Path(args.outdir) / args.book_id
     sections_dir = base / "sections"
     sections_dir.mkdir(parents=True, exist_ok=True)
 
-    # Write sections as separate JSON files
+    # A few ranges per worker keeps the pool busy when some pages are slower
+    parts = args.workers * 4 if args.workers > 1 else 1
+    prev_manifest, prev_texts = load_previous(base) if args.incremental else (None, None)
+    if prev_manifest is not None:
+        # Hash every page block first, so only blocks that changed are extracted
+        block_hashes = fingerprint_blocks(str(pdf_path), args.pages_per_block)
+        reuse = reusable_blocks(block_hashes, prev_manifest, prev_texts, args.pages_per_block)
+        ranges = dirty_ranges(block_hashes, reuse, parts)
+        extracted = iter_extracted(str(pdf_path), args.pages_per_block, ranges, args.workers)
+        blocks = merge_blocks(block_hashes, reuse, prev_texts, extracted)
+    else:
+        # Nothing to reuse: one pass extracts every block and fingerprints it on the way
+        block_hashes, reuse = [], {}
+        ranges = page_ranges(pdf_page_count(str(pdf_path)), args.pages_per_block, parts)
+        blocks = fresh_blocks(iter_extracted(str(pdf_path), args.pages_per_block, ranges, args.workers),
+                              block_hashes)
+
+    prev_shas = {sec["section_id"]: sec["sha"]
+                 for block in (prev_manifest or {}).get("blocks", []) for sec in block["sections"]}
+
+    # The run's timestamp goes in toc.json only: every other file is byte-identical
+    # when the content is, so an unchanged re-run skips them on upload (same MD5)
+    book = {
+        "book_id": args.book_id,
+        "subject": args.subject,
+        "source_pdf": pdf_path.name
+    }
+    toc = dict(book, created_at=ts)
+    shard = ShardWriter(base / "shard.json", book)               # everything /ask needs in one object
+    binary = BinaryIndexWriter(base / "index.bin", book)        # binary variant /ask can mmap from /tmp
+    bm25 = Bm25Builder()                                        # inverted index for BM25 ranking in /ask
+    uploader = None
+    if args.s3_bucket:
+        prefix = args.s3_prefix or f"indexes/{args.book_id}"
+        uploader = Uploader(base, args.s3_bucket, prefix, args.kms_alias, workers=args.upload_workers)
+
+    # Sections stream through: each is written (only if new or changed when incremental),
+    # queued for upload and appended to the shard, binary index and BM25 postings while
+    # later pages are still being extracted. Only per-section metadata stays in memory.
     section_entries: List[Dict[str, Any]] = []
-    for i, ch in enumerate(chunks):
+    section_shas: List[Dict[str, Any]] = []
+    written = 0
+    for ch in number_chunks(blocks):
         section_id = f"{args.book_id}-b{ch['block_index']}-s{ch['sub_index']}"
         section_obj = {
             "book_id": args.book_id,
@@ -118,10 +784,18 @@ def main():
             "page_start": ch["page_start"],
             "page_end": ch["page_end"],
             "text": ch["text"],
-            "source_pdf": pdf_path.name,
-            "created_at": ts
+            "sentences": sentence_starts(ch["text"]),
+            "source_pdf": pdf_path.name
         }
-        write_json(sections_dir / f"{section_id}.json", section_obj)
+        sha = text_sha(ch["text"])
+        if prev_shas.get(section_id) != sha:
+            write_json(sections_dir / f"{section_id}.json", section_obj)
+            written += 1
+            if uploader:
+                uploader.submit(f"sections/{section_id}.json")
+        shard.add(section_obj)
+        binary.add(section_obj)
+        bm25.add(section_id, ch["text"])
         section_entries.append({
             "section_id": section_id,
             "title": section_obj["title"],
@@ -129,23 +803,45 @@ def main():
             "page_end": ch["page_end"],
             "bytes": len(section_obj["text"].encode("utf-8"))
         })
+        section_shas.append({"section_id": section_id, "page_start": ch["page_start"], "sha": sha})
+    print(f"Extracted {len(block_hashes) - len(reuse)} of {len(block_hashes)} page blocks")
 
-    # Write TOC
-    toc = {
-        "book_id": args.book_id,
-        "subject": args.subject,
-        "source_pdf": pdf_path.name,
-        "created_at": ts,
-        "sections": section_entries
-    }
-    write_json(base / "toc.json", toc)
+    removed = sorted(set(prev_shas) - {sec["section_id"] for sec in section_entries})
+    for section_id in removed:
+        (sections_dir / f"{section_id}.json").unlink(missing_ok=True)
 
-    print(f"Wrote {len(section_entries)} sections to {sections_dir}")
+    shard.close()
+    binary.close()
+    if prev_texts is not None:
+        prev_texts.close()
+    index = bm25.build()
+    with (base / "bm25.json").open("w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    # Dense LSA vectors so /ask can match paraphrases that share no keywords
+    lsa = lsa_vectors(index, args.lsa_dims) if args.lsa_dims > 0 else None
+    if lsa is not None:
+        write_lsa(base / "lsa.bin", lsa)
+    else:
+        # a stale lsa.bin would rank against the previous edition's sections
+        (base / "lsa.bin").unlink(missing_ok=True)
+        if args.lsa_dims > 0:
+            print("Skipping lsa.bin: " + ("numpy not installed" if np is None else "too little text"))
+    write_json(base / "toc.json", dict(toc, sections=section_entries))
+    # Page-block and chunk hashes for the next --incremental run
+    write_json(base / "manifest.json", build_manifest(args.book_id, args.pages_per_block, block_hashes, section_shas))
 
-    # Optional upload
-    if args.s3_bucket:
-        prefix = args.s3_prefix or f"indexes/{args.book_id}"
-        upload_dir_to_s3(base, args.s3_bucket, prefix, args.kms_alias)
+    print(f"Wrote {len(section_entries)} sections to {sections_dir} "
+          f"({written} new or changed, {len(removed)} removed)")
+
+    # Book-level files go up only after every section they reference is in S3
+    if uploader:
+        uploader.wait()
+        for name in ("toc.json", "shard.json", "index.bin", "bm25.json", "manifest.json"):
+            uploader.submit(name)
+        if lsa is not None:
+            uploader.submit("lsa.bin")
+        uploader.close(delete=[f"sections/{section_id}.json" for section_id in removed]
+                       + ([] if lsa is not None else ["lsa.bin"]))
         print(f"Uploaded index to s3://{args.s3_bucket}/{prefix}/")
 
 if __name__ == "__main__":